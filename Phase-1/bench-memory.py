@@ -0,0 +1,108 @@
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+import detector
+
+# ======= DETECTOR MEMORY BENCHMARK ======= #
+# Peak RSS of one scanner worker: detects and warps every scan in a fresh child
+# process (ru_maxrss only ever goes up, so each configuration needs its own
+# process) and reports the peak above the RSS measured right after the first
+# imread. Run it on the same scans before and after a detector change. The
+# "old preprocessing" configuration swaps maskBackground() for the noise fill,
+# copy and inverted-mask path it replaced, and warps from that padded frame
+# like the full resolution path used to, as the baseline to compare against.
+
+oldPadded = None  # the last noise-padded frame, old preprocessing only
+
+
+def oldMaskBackground(image, pad, gray=None):
+    # noise-filled padding, a full-frame copy, then inRange -> bitwise_not ->
+    # bitwise_and into a third frame
+    global oldPadded
+    lower, upper = detector.grayRange(gray)
+    h, w = image.shape[:2]
+    oldPadded = np.random.randint(detector.z, detector.t, (h + 2 * pad, w + 2 * pad, 3), dtype=np.uint8)
+    oldPadded[pad : pad + h, pad : pad + w] = image
+    grayMask = cv2.inRange(oldPadded, lower, upper)
+    return cv2.bitwise_and(oldPadded, oldPadded, mask=cv2.bitwise_not(grayMask))
+
+
+def maxRssMb():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def runChild(scans, reuse, detectScale, old=False):
+    global oldPadded
+    detector.reuseBuffers = reuse
+    detector.detectScale = detectScale
+    if old:
+        detector.maskBackground = oldMaskBackground
+    cv2.setNumThreads(1)
+
+    baseline = None
+    start = time.time()
+    for path in scans:
+        image = cv2.imread(path)
+        if baseline is None:
+            baseline = maxRssMb()
+        detection = detector.findPostcardContours(image)
+        source, offset = detection["warpSource"], detection["warpOffset"]
+        if old and not detectScale:
+            # the full resolution path warped from the padded frame
+            source, offset = oldPadded, 0
+        detector.warpCards(source, detection["geometry"], offset)
+        del image, detection, source
+        oldPadded = None
+
+    print(json.dumps({
+        "peakMb": maxRssMb(),
+        "overImageMb": maxRssMb() - baseline,
+        "secondsPerScan": (time.time() - start) / len(scans),
+    }))
+
+
+def runConfig(scans, reuse, detectScale, old=False):
+    cmd = [sys.executable, __file__, "--child", "--detect-scale", str(detectScale or 0)]
+    if reuse:
+        cmd.append("--reuse")
+    if old:
+        cmd.append("--old-preprocessing")
+    out = subprocess.run(cmd + scans, check=True, capture_output=True, text=True).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure peak RSS of scan detection")
+    parser.add_argument("scans", nargs="*", help="scans to run (default: everything in _INPUT)")
+    parser.add_argument("--detect-scale", type=float, default=0, help="also passed to the detector (0: full resolution)")
+    parser.add_argument("--reuse", action="store_true", help="keep the scratch buffers between scans (detector.reuseBuffers)")
+    parser.add_argument("--old-preprocessing", action="store_true", help="noise-pad, copy and mask like the detector used to")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    scans = args.scans or detector.listScans("front") + detector.listScans("back")
+    if not scans:
+        print(f"[ERROR] No scans found in {detector.inputDir}")
+        sys.exit(1)
+
+    if args.child:
+        runChild(scans, args.reuse, args.detect_scale or None, args.old_preprocessing)
+        sys.exit(0)
+
+    print(f"[INFO] {len(scans)} scans, detect scale {args.detect_scale or 'full'}")
+    configs = (("old preprocessing", False, True), ("fresh buffers", False, False), ("reused buffers", True, False))
+    for label, reuse, old in configs:
+        stats = runConfig(scans, reuse, args.detect_scale, old)
+        print(
+            f"[MEM] {label:>17}: peak {stats['peakMb']:.0f} MB, "
+            f"{stats['overImageMb']:.0f} MB over the loaded scan, "
+            f"{stats['secondsPerScan']:.2f}s/scan"
+        )
@@ -0,0 +1,241 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import combiner
+import detector
+import imageWriter
+import syntheticScans
+
+# ======= PIPELINE BENCHMARK SUITE ======= #
+# Times every stage (detect, warp, match, composite, write) on synthetic scan
+# pairs from syntheticScans.py, over a grid of scan sizes, card counts and
+# backgrounds, and checks detection and matching against the generated ground
+# truth. Scans are generated from --seed, so two commits benchmarked with the
+# same arguments see the same pixels. Results go to a JSON file, and --compare
+# prints the change against an earlier one.
+#
+#   python3 bench-suite.py --out before.json
+#   (change something)
+#   python3 bench-suite.py --out after.json --compare before.json
+
+stages = ("detect", "warp", "match", "composite", "write")
+
+
+def gitRevision():
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def assignTruth(cards, truthBoxes, tolerance):
+    # detected card -> index of the generated card it is, or None. Returns the
+    # assignment and the corner error of every hit.
+    offset = detector.padSize
+    assigned, errors = [], []
+    for card in cards:
+        box = np.array(card["box"], np.float32) - offset
+        centre = box.mean(axis=0)
+        i = min(range(len(truthBoxes)), key=lambda j: np.linalg.norm(truthBoxes[j].mean(axis=0) - centre))
+        error = syntheticScans.cornerDistance(truthBoxes[i], box)
+        if error <= tolerance and i not in assigned:
+            assigned.append(i)
+            errors.append(error)
+        else:
+            assigned.append(None)
+    return assigned, errors
+
+
+def timed(times, stage, fn, *args):
+    start = time.perf_counter()
+    out = fn(*args)
+    times[stage] += time.perf_counter() - start
+    return out
+
+
+def runPair(front, back, truth, times, writeDir, tolerance):
+    # one scan pair through every stage, returns its accuracy counts
+    sides = {}
+    for side, scan in (("front", front), ("back", back)):
+        detection = timed(times, "detect", detector.findPostcardContours, scan)
+        cards = timed(times, "warp", detector.warpCards, detection["warpSource"], detection["geometry"], detection["warpOffset"])
+        sides[side] = (cards, *assignTruth(cards, truth[side], tolerance))
+
+    frontCards = {f"f{i}": card for i, card in enumerate(sides["front"][0])}
+    backCards = {f"b{i}": card for i, card in enumerate(sides["back"][0])}
+    matches = timed(times, "match", combiner.matchCards, frontCards, backCards)
+
+    correct = 0
+    composites = []
+    for frontID, backID, _ in matches:
+        if backID is None:
+            continue
+        f, b = int(frontID[1:]), int(backID[1:])
+        frontTruth, backTruth = sides["front"][1][f], sides["back"][1][b]
+        correct += frontTruth is not None and frontTruth == backTruth
+        composites.append(timed(times, "composite", combiner.buildComposite, frontCards[frontID]["warped"], backCards[backID]["warped"]))
+
+    start = time.perf_counter()
+    for i, image in enumerate([c["warped"] for cards, _, _ in sides.values() for c in cards] + composites):
+        path = os.path.join(writeDir, f"{i}.png")
+        cv2.imwrite(path, image, imageWriter.encodeParams(path))
+    times["write"] += time.perf_counter() - start
+
+    expected = len(truth["front"])
+    return {
+        "cards": 2 * expected,
+        "detected": sum(len(cards) for cards, _, _ in sides.values()),
+        "hits": sum(len(errors) for _, _, errors in sides.values()),
+        "cornerErrors": [float(e) for _, _, errors in sides.values() for e in errors],
+        "pairs": expected,
+        "correctMatches": int(correct),
+    }
+
+
+def runConfig(dpi, cards, kind, scans, seed, tolerance):
+    times = dict.fromkeys(stages, 0.0)
+    totals = {"cards": 0, "detected": 0, "hits": 0, "cornerErrors": [], "pairs": 0, "correctMatches": 0}
+    generateTime = 0.0
+    with tempfile.TemporaryDirectory() as writeDir:
+        for n in range(scans):
+            start = time.perf_counter()
+            front, back, truth = syntheticScans.generatePair(seed + n, dpi=dpi, cards=cards, kind=kind)
+            generateTime += time.perf_counter() - start
+            counts = runPair(front, back, truth, times, writeDir, tolerance)
+            for key, value in counts.items():
+                totals[key] += value
+
+    errors = totals.pop("cornerErrors")
+    return {
+        "dpi": dpi,
+        "cards": cards,
+        "background": kind,
+        "scanPairs": scans,
+        "generateSeconds": generateTime,
+        # per scan pair, in ms
+        "stagesMs": {stage: 1000 * times[stage] / scans for stage in stages},
+        "totalMs": 1000 * sum(times.values()) / scans,
+        "accuracy": {
+            "detectionRecall": totals["hits"] / totals["cards"],
+            "falseDetections": totals["detected"] - totals["hits"],
+            "meanCornerErrorPx": float(np.mean(errors)) if errors else None,
+            "maxCornerErrorPx": float(np.max(errors)) if errors else None,
+            "matchAccuracy": totals["correctMatches"] / totals["pairs"],
+        },
+    }
+
+
+def ms(value):
+    return f"{value:.0f}" if value >= 10 else f"{value:.2f}"
+
+
+def configName(config):
+    return f"{config['dpi']}dpi x{config['cards']} {config['background']}"
+
+
+def printConfig(config):
+    stageText = "  ".join(f"{stage} {ms(config['stagesMs'][stage])}" for stage in stages)
+    acc = config["accuracy"]
+    print(f"[BENCH] {configName(config):>18}: {config['totalMs']:.0f} ms/pair ({stageText})")
+    print(
+        f"        detection recall {acc['detectionRecall']:.1%}, {acc['falseDetections']} false, "
+        f"corner error {acc['meanCornerErrorPx'] or 0:.1f}px mean / {acc['maxCornerErrorPx'] or 0:.1f}px max, "
+        f"match accuracy {acc['matchAccuracy']:.1%}"
+    )
+
+
+def compare(results, baseline):
+    # stage times and accuracy against an earlier results file, config by config
+    print(f"\n[COMPARE] {baseline.get('revision')} -> {results.get('revision')}")
+    old = {configName(c): c for c in baseline["configs"]}
+    for config in results["configs"]:
+        before = old.get(configName(config))
+        if before is None:
+            print(f"[COMPARE] {configName(config)}: not in the baseline")
+            continue
+        changes = []
+        for stage in stages + ("total",):
+            a = before["totalMs"] if stage == "total" else before["stagesMs"][stage]
+            b = config["totalMs"] if stage == "total" else config["stagesMs"][stage]
+            changes.append(f"{stage} {ms(a)}->{ms(b)}ms ({100 * (b - a) / a:+.0f}%)" if a else f"{stage} {ms(b)}ms")
+        print(f"[COMPARE] {configName(config):>18}: " + ", ".join(changes))
+        for key in ("detectionRecall", "matchAccuracy", "falseDetections"):
+            if before["accuracy"][key] != config["accuracy"][key]:
+                print(f"[COMPARE] {'':>18}  {key} {before['accuracy'][key]} -> {config['accuracy'][key]}")
+
+
+def csvList(kind):
+    return lambda text: [kind(v) for v in text.split(",")]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Time and check every pipeline stage on synthetic scans")
+    parser.add_argument("--dpi", type=csvList(int), default=[150, 300], help="scan resolutions (default: 150,300)")
+    parser.add_argument("--cards", type=csvList(int), default=[4, 6], help="cards per scan (default: 4,6)")
+    parser.add_argument("--background", type=csvList(str), default=["gray"], help="gray and/or black (default: gray)")
+    parser.add_argument("--scans", type=int, default=3, help="scan pairs per configuration (default: 3)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tolerance", type=float, default=8.0, help="max corner error in px for a card to count as found (default: 8)")
+    parser.add_argument("--threads", type=int, default=1, help="OpenCV threads (default: 1, like a scanner worker)")
+    parser.add_argument("--out", help="write the results as JSON")
+    parser.add_argument("--compare", help="an earlier --out file to compare against")
+    parser.add_argument("--write-scans", metavar="DIR", help="only write the scan pairs as scNN-front/back.png, for the scanner scripts")
+    detector.addArguments(parser)
+    args = parser.parse_args()
+    detector.configureFromArgs(args)
+    cv2.setNumThreads(args.threads)
+
+    for kind in args.background:
+        if kind not in syntheticScans.backgrounds:
+            parser.error(f"unknown background {kind}, pick from {', '.join(syntheticScans.backgrounds)}")
+
+    if args.write_scans:
+        os.makedirs(args.write_scans, exist_ok=True)
+        for n in range(args.scans):
+            syntheticScans.writePair(args.write_scans, n + 1, args.seed + n, dpi=args.dpi[0], cards=args.cards[0], kind=args.background[0])
+        print(f"[INFO] Wrote {args.scans} scan pairs to {args.write_scans}")
+        sys.exit(0)
+
+    results = {
+        "revision": gitRevision(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "machine": {"python": platform.python_version(), "opencv": cv2.__version__, "cpus": os.cpu_count()},
+        "settings": {
+            "seed": args.seed,
+            "scans": args.scans,
+            "tolerance": args.tolerance,
+            "threads": args.threads,
+            "detector": detector.settings(),
+        },
+        "configs": [],
+    }
+    for dpi in args.dpi:
+        for cards in args.cards:
+            for kind in args.background:
+                config = runConfig(dpi, cards, kind, args.scans, args.seed, args.tolerance)
+                printConfig(config)
+                results["configs"].append(config)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"[INFO] Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,30 @@
+import argparse
+import os
+
+import cardStore
+
+# ======= CARD STORE TOOLS ======= #
+# The store imports the old JSON/txt files by itself when cards.db is first
+# created. `import` re-runs that by hand. `export-analysis` writes the analysis
+# records out sorted, as .json (the old analysis.json layout), .jsonl or .csv.
+# `compact` checkpoints the WAL and vacuums the database.
+
+parser = argparse.ArgumentParser(description="Manage the SQLite card store")
+parser.add_argument("--db", default=cardStore.dbPath, help=f"database file (default: {cardStore.dbPath})")
+commands = parser.add_subparsers(dest="command", required=True)
+commands.add_parser("import", help="import frontCoords/backCoords.json, counters, cardMatches.txt and analysis.json")
+exportParser = commands.add_parser("export-analysis", help="write every analysis record to one .json, .jsonl or .csv file")
+exportParser.add_argument("path", nargs="?", default="analysis.json")
+commands.add_parser("compact", help="checkpoint the WAL and vacuum the database")
+args = parser.parse_args()
+
+cardStore.dbPath = args.db
+if args.command == "import":
+    cardStore.importLegacy()
+elif args.command == "export-analysis":
+    count = cardStore.exportAnalysis(args.path)
+    print(f"[INFO] Wrote {count} records to {args.path}")
+elif args.command == "compact":
+    before = os.path.getsize(args.db) + (os.path.getsize(args.db + "-wal") if os.path.exists(args.db + "-wal") else 0)
+    cardStore.compact()
+    print(f"[INFO] {args.db}: {before / 1e6:.1f} MB -> {os.path.getsize(args.db) / 1e6:.1f} MB")
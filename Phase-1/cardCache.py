@@ -0,0 +1,76 @@
+import threading
+from collections import OrderedDict
+
+import imageWriter
+import metrics
+
+# ======= IN-MEMORY CARD CACHE ======= #
+# Hands warped cards (and the raw front scan used for the overlay) from the
+# scanner to the combiner without a PNG encode/decode in between. The cache is
+# an LRU bounded by bytes. Every entry remembers the PNG path it belongs to, so
+# an entry that gets evicted before it has been written is spilled to disk
+# instead of being lost. PNG writes go through imageWriter.
+
+maxBytes = 1024 * 1024 * 1024  # ~40 full scans worth of cards
+
+lock = threading.Lock()
+entries = OrderedDict()  # key -> (image, path)
+cacheBytes = 0
+hits = 0
+misses = 0
+
+
+def put(key, image, path=None, written=True):
+    # path + written=False means the image only exists here, spill it on eviction
+    global cacheBytes
+    spill = []
+    with lock:
+        if key in entries:
+            cacheBytes -= entries.pop(key)[0].nbytes
+        entries[key] = (image, None if written else path)
+        cacheBytes += image.nbytes
+        while cacheBytes > maxBytes and len(entries) > 1:
+            oldKey, (oldImage, oldPath) = entries.popitem(last=False)
+            cacheBytes -= oldImage.nbytes
+            if oldPath is not None:
+                spill.append((oldPath, oldImage))
+    for spillPath, spillImage in spill:
+        imageWriter.write(spillPath, spillImage)
+
+
+def take(key):
+    # cards are consumed once by the combiner, so pop rather than keep them around
+    global cacheBytes, hits, misses
+    with lock:
+        entry = entries.pop(key, None)
+        if entry is None:
+            misses += 1
+            return None
+        hits += 1
+        cacheBytes -= entry[0].nbytes
+    return entry[0]
+
+
+def load(key, path):
+    image = take(key)
+    if image is not None:
+        return image
+    imageWriter.waitFor(path)
+    return metrics.imread(path)
+
+
+def stats():
+    with lock:
+        return {"hits": hits, "misses": misses, "entries": len(entries), "bytes": cacheBytes}
+
+
+def flush():
+    # spill whatever was never consumed, then wait for every pending write
+    global cacheBytes
+    with lock:
+        spill = [(path, image) for image, path in entries.values() if path is not None]
+        entries.clear()
+        cacheBytes = 0
+    for path, image in spill:
+        imageWriter.write(path, image)
+    imageWriter.flush()
@@ -0,0 +1,406 @@
+import csv
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+
+# ======= CARD STORE ======= #
+# One SQLite database (WAL mode) for everything the stages used to keep in
+# whole-file JSON/txt: scans and their input hashes, detected cards with their
+# centroid and crop box, front/back matches and analysis records. Every write
+# is a small transaction on the rows it touches, so nothing gets rewritten
+# whole and a crash only loses the scan in flight. Each thread gets its own
+# connection, the pipeline commits, combines and analyses on a thread pool.
+
+dbPath = "cards.db"
+
+# files the store replaces, read once by importLegacy()
+legacyPaths = {
+    "state": "counters/{side}.json",
+    "seen": "counters/scanned{title}.txt",
+    "index": "counters/index{title}.txt",
+    "coords": "debug/{side}Coords.json",
+    "matches": "debug/cardMatches.txt",
+    "analysis": "analysis.json",
+}
+
+schema = """
+CREATE TABLE IF NOT EXISTS scans (
+    name TEXT PRIMARY KEY,
+    side TEXT NOT NULL,
+    hash TEXT,
+    params TEXT,
+    stamp TEXT,
+    written INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS scansBySide ON scans (side);
+CREATE TABLE IF NOT EXISTS cards (
+    side TEXT NOT NULL,
+    name TEXT NOT NULL,
+    scan TEXT NOT NULL,
+    x INTEGER NOT NULL,
+    y INTEGER NOT NULL,
+    box TEXT,
+    PRIMARY KEY (side, name)
+);
+CREATE INDEX IF NOT EXISTS cardsByScan ON cards (scan);
+CREATE TABLE IF NOT EXISTS counters (
+    side TEXT PRIMARY KEY,
+    next INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS matches (
+    front TEXT PRIMARY KEY,
+    back TEXT NOT NULL,
+    scan TEXT NOT NULL,
+    area REAL
+);
+CREATE INDEX IF NOT EXISTS matchesByScan ON matches (scan);
+CREATE TABLE IF NOT EXISTS analysis (
+    image TEXT PRIMARY KEY,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS analysisCache (
+    inputHash TEXT NOT NULL,
+    model TEXT NOT NULL,
+    promptHash TEXT NOT NULL,
+    image TEXT NOT NULL,
+    data TEXT NOT NULL,
+    updated REAL NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 1,
+    PRIMARY KEY (inputHash, model, promptHash)
+);
+CREATE INDEX IF NOT EXISTS analysisCacheByImage ON analysisCache (image);
+CREATE TABLE IF NOT EXISTS orientations (
+    hash TEXT PRIMARY KEY,
+    rotate INTEGER NOT NULL,
+    confidence REAL NOT NULL,
+    method TEXT NOT NULL
+);
+"""
+
+local = threading.local()
+initLock = threading.Lock()
+initialised = set()
+
+
+def connect():
+    conn = getattr(local, "conn", None)
+    if conn is not None and local.path == dbPath:
+        return conn
+
+    with initLock:
+        fresh = not os.path.exists(dbPath)
+        conn = sqlite3.connect(dbPath, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if dbPath not in initialised:
+            conn.executescript(schema)
+            migrate(conn)
+            initialised.add(dbPath)
+            if fresh:
+                importLegacy(conn)
+    local.conn, local.path = conn, dbPath
+    return conn
+
+
+def migrate(conn):
+    # columns added after a table was first created
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(analysisCache)")}
+    if "complete" not in columns:
+        conn.execute("ALTER TABLE analysisCache ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+
+
+# === SCANS AND CARDS ===
+def loadScans(side):
+    # {scanName: {hash, params, stamp, written, cards: [cardName, ...]}}
+    conn = connect()
+    scans = {}
+    for name, digest, params, stamp, written in conn.execute(
+        "SELECT name, hash, params, stamp, written FROM scans WHERE side = ?", (side,)
+    ):
+        scans[name] = {
+            "hash": digest,
+            "params": params,
+            "stamp": json.loads(stamp) if stamp else None,
+            "written": bool(written),
+            "cards": [],
+        }
+    for scan, name in conn.execute("SELECT scan, name FROM cards WHERE side = ? ORDER BY name", (side,)):
+        if scan in scans:
+            scans[scan]["cards"].append(name)
+    return scans
+
+
+def loadCoords(side):
+    # {scanName: {cardName: {"x": x, "y": y}}}, what the combiner matches on
+    coords = {}
+    for scan, name, x, y in connect().execute(
+        "SELECT scan, name, x, y FROM cards WHERE side = ? ORDER BY scan, name", (side,)
+    ):
+        coords.setdefault(scan, {})[name] = {"x": x, "y": y}
+    return coords
+
+
+def nextCard(side):
+    row = connect().execute("SELECT next FROM counters WHERE side = ?", (side,)).fetchone()
+    return row[0] if row else 1
+
+
+def saveScan(side, scanName, entry, cards, nextIndex):
+    # Replace one scan, its cards and the card counter in a single transaction.
+    # cards = [(cardName, x, y, box), ...]
+    conn = connect()
+    with conn:
+        upsertScan(conn, side, scanName, entry)
+        conn.execute("DELETE FROM cards WHERE scan = ?", (scanName,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO cards (side, name, scan, x, y, box) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (side, name, scanName, x, y, json.dumps(box) if box is not None else None)
+                for name, x, y, box in cards
+            ],
+        )
+        conn.execute(
+            "INSERT INTO counters (side, next) VALUES (?, ?) "
+            "ON CONFLICT (side) DO UPDATE SET next = excluded.next",
+            (side, nextIndex),
+        )
+
+
+def updateScanKey(side, scanName, entry):
+    conn = connect()
+    with conn:
+        upsertScan(conn, side, scanName, entry)
+
+
+def upsertScan(conn, side, scanName, entry):
+    stamp = entry.get("stamp")
+    conn.execute(
+        "INSERT INTO scans (name, side, hash, params, stamp, written) VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (name) DO UPDATE SET hash = excluded.hash, params = excluded.params, "
+        "stamp = excluded.stamp, written = excluded.written",
+        (scanName, side, entry.get("hash"), entry.get("params"), json.dumps(stamp) if stamp else None, int(entry.get("written", True))),
+    )
+
+
+# === MATCHES ===
+def saveMatches(scanPrefix, matches):
+    # matches = [(frontCard, backCard, overlapArea), ...], replaces the scan's old ones
+    conn = connect()
+    with conn:
+        conn.execute("DELETE FROM matches WHERE scan = ?", (scanPrefix,))
+        conn.executemany(
+            "INSERT OR REPLACE INTO matches (front, back, scan, area) VALUES (?, ?, ?, ?)",
+            [(front, back, scanPrefix, area) for front, back, area in matches],
+        )
+
+
+def loadMatches():
+    return connect().execute("SELECT front, back FROM matches ORDER BY front").fetchall()
+
+
+# === ORIENTATIONS ===
+def loadOrientations(hashes):
+    # {cardHash: clockwise turn} for the hashes already worked out. Undecided
+    # rows, which older runs kept, are looked at again.
+    found = {}
+    conn = connect()
+    for start in range(0, len(hashes), 500):
+        chunk = hashes[start : start + 500]
+        marks = ", ".join("?" * len(chunk))
+        found.update(
+            conn.execute(f"SELECT hash, rotate FROM orientations WHERE method != 'none' AND hash IN ({marks})", chunk)
+        )
+    return found
+
+
+def saveOrientations(rows):
+    # rows = [(cardHash, rotate, confidence, method), ...]
+    conn = connect()
+    with conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO orientations (hash, rotate, confidence, method) VALUES (?, ?, ?, ?)", rows
+        )
+
+
+# === ANALYSIS ===
+def getAnalysis(image):
+    row = connect().execute("SELECT data FROM analysis WHERE image = ?", (image,)).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def saveAnalysis(image, data, cacheKey=None, complete=True):
+    # The analysis table holds the current record per image. With a cacheKey
+    # (inputHash, model, promptHash) the result is also kept in analysisCache,
+    # so switching back to that model/prompt later needs no new request. A
+    # record that is not `complete` (fields were missing from the reply) is
+    # kept there too, but never handed out again by cachedAnalysis().
+    conn = connect()
+    with conn:
+        conn.execute(
+            "INSERT INTO analysis (image, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT (image) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (image, json.dumps(data), time.time()),
+        )
+        if cacheKey is not None:
+            conn.execute(
+                "INSERT OR REPLACE INTO analysisCache (inputHash, model, promptHash, image, data, updated, complete) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (*cacheKey, image, json.dumps(data), time.time(), int(complete)),
+            )
+
+
+def cachedAnalysis(cacheKey):
+    row = connect().execute(
+        "SELECT data FROM analysisCache WHERE inputHash = ? AND model = ? AND promptHash = ? AND complete", cacheKey
+    ).fetchone()
+    return json.loads(row[0]) if row else None
+
+
+def hasCachedImage(image):
+    # False for records saved before the analysis cache existed
+    row = connect().execute("SELECT 1 FROM analysisCache WHERE image = ? LIMIT 1", (image,)).fetchone()
+    return row is not None
+
+
+def iterAnalysis():
+    # (image, record) sorted by image, streamed from the cursor
+    for image, data in connect().execute("SELECT image, data FROM analysis ORDER BY image"):
+        yield image, json.loads(data)
+
+
+def loadAnalysis():
+    return dict(iterAnalysis())
+
+
+def flatten(record, prefix=""):
+    # {"front": {"caption": ..}} -> {"front.caption": ..}, lists joined with "; "
+    flat = {}
+    for key, value in record.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, list):
+            flat[prefix + key] = "; ".join(str(v) for v in value if v != "")
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def exportAnalysis(path):
+    # Sorted export, the format follows the extension: .json is the old
+    # analysis.json layout, .jsonl one {"image", "analysis"} object per line,
+    # .csv one row per image with nested fields flattened to dotted columns.
+    ext = os.path.splitext(path)[1].lower()
+    count = 0
+    with open(path, "w", newline="" if ext == ".csv" else None) as f:
+        if ext == ".jsonl":
+            for image, record in iterAnalysis():
+                f.write(json.dumps({"image": image, "analysis": record}) + "\n")
+                count += 1
+        elif ext == ".csv":
+            columns = {"image": None}
+            for _, record in iterAnalysis():
+                columns.update(dict.fromkeys(flatten(record)))
+            writer = csv.DictWriter(f, fieldnames=list(columns), extrasaction="ignore")
+            writer.writeheader()
+            for image, record in iterAnalysis():
+                writer.writerow(dict(flatten(record), image=image))
+                count += 1
+        else:
+            # streamed, so the whole collection never sits in memory as one dict
+            f.write("{")
+            for image, record in iterAnalysis():
+                body = json.dumps(record, indent=4).replace("\n", "\n    ")
+                f.write(("," if count else "") + f"\n    {json.dumps(image)}: {body}")
+                count += 1
+            f.write("\n}" if count else "}")
+    return count
+
+
+def compact():
+    # fold the WAL back into the database file and drop free pages
+    conn = connect()
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.execute("VACUUM")
+
+
+# === ONE-TIME IMPORT ===
+def readJson(path):
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def importLegacy(conn=None):
+    # Pull the old JSON/txt files into the store. Runs by itself when the
+    # database is first created, re-running it only overwrites rows with the
+    # same key.
+    conn = conn or connect()
+    counts = {"scans": 0, "cards": 0, "matches": 0, "analysis": 0}
+
+    with conn:
+        for side in ("front", "back"):
+            fill = {"side": side, "title": side.capitalize()}
+            coords = readJson(legacyPaths["coords"].format(**fill)) or {}
+            for scanName, cards in coords.items():
+                for cardName, c in cards.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO cards (side, name, scan, x, y) VALUES (?, ?, ?, ?, ?)",
+                        (side, cardName, scanName, c["x"], c["y"]),
+                    )
+                    counts["cards"] += 1
+
+            saved = readJson(legacyPaths["state"].format(**fill))
+            if saved is not None:
+                nextIndex = saved["index"]
+                scans = saved["scans"]
+            else:
+                # scanned/index counters: hashes are filled in, not checked,
+                # the first time the scanner sees each scan
+                seenPath = legacyPaths["seen"].format(**fill)
+                indexPath = legacyPaths["index"].format(**fill)
+                if not os.path.exists(seenPath):
+                    continue
+                with open(seenPath, "r") as f:
+                    scans = {name: {} for name in f.read().splitlines() if name}
+                nextIndex = 1
+                if os.path.exists(indexPath):
+                    with open(indexPath, "r") as f:
+                        nextIndex = int(f.read().strip())
+
+            for scanName, entry in scans.items():
+                upsertScan(conn, side, scanName, entry)
+                counts["scans"] += 1
+            conn.execute(
+                "INSERT OR REPLACE INTO counters (side, next) VALUES (?, ?)", (side, nextIndex)
+            )
+
+        if os.path.exists(legacyPaths["matches"]):
+            with open(legacyPaths["matches"], "r") as f:
+                pairs = re.findall(r"\[([^,\]]+),([^\]]+)\]", f.read())
+            for front, back in pairs:
+                row = conn.execute("SELECT scan FROM cards WHERE side = 'front' AND name = ?", (front,)).fetchone()
+                scan = row[0].rsplit("-", 1)[0] if row else ""
+                conn.execute(
+                    "INSERT OR REPLACE INTO matches (front, back, scan) VALUES (?, ?, ?)", (front, back, scan)
+                )
+                counts["matches"] += 1
+
+        analysis = readJson(legacyPaths["analysis"]) or {}
+        for image, data in analysis.items():
+            conn.execute(
+                "INSERT OR REPLACE INTO analysis (image, data, updated) VALUES (?, ?, ?)",
+                (image, json.dumps(data), time.time()),
+            )
+            counts["analysis"] += 1
+
+    if any(counts.values()):
+        print(
+            f"[INFO] Imported {counts['scans']} scans, {counts['cards']} cards, "
+            f"{counts['matches']} matches and {counts['analysis']} analysis records into {dbPath}"
+        )
+    return counts
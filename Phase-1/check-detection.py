@@ -0,0 +1,83 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import detector
+import syntheticScans
+
+# ======= DETECTION ACCURACY CHECK ======= #
+# Runs the full resolution detector and the --detect-scale one on synthetic
+# scans from syntheticScans.py and measures both crops (the minAreaRect box
+# warpCards() warps from) against the corners the cards were pasted at. Neither
+# path is exact, the full resolution crops sit 3-7px off the truth at 300dpi,
+# so a card passes when the scaled crop is at most --tolerance px further from
+# the truth than the full resolution crop it replaces. The default 2px is half
+# a detection pixel at x0.25: a contour that was snapped back to the full
+# resolution edge lands well inside it, one that was only scaled up does not.
+# Exits non-zero if a card fails or either path misses a card.
+
+
+def cropBoxes(image, scale):
+    detector.detectScale = scale
+    start = time.time()
+    detection = detector.findPostcardContours(image)
+    took = time.time() - start
+    # detection runs on the padded scan, the truth is in scan coordinates
+    boxes = [card["box"].astype(np.float32) - detector.padSize for card in detection["geometry"]]
+    return boxes, took
+
+
+def truthErrors(boxes, truthBoxes):
+    # corner error of every generated card against the nearest box found, None if missed
+    errors = []
+    for truth in truthBoxes:
+        if not boxes:
+            errors.append(None)
+            continue
+        centre = truth.mean(axis=0)
+        box = min(boxes, key=lambda b: np.linalg.norm(b.mean(axis=0) - centre))
+        error = syntheticScans.cornerDistance(truth, box)
+        # further off than a quarter of the card's short side is some other card
+        shortSide = min(np.linalg.norm(truth[1] - truth[0]), np.linalg.norm(truth[2] - truth[1]))
+        errors.append(error if error < shortSide / 4 else None)
+    return errors
+
+
+def checkScan(name, image, truthBoxes, scale, tolerance):
+    fullBoxes, fullTime = cropBoxes(image, None)
+    lowBoxes, lowTime = cropBoxes(image, scale)
+    print(f"[INFO] {name}: full {fullTime:.2f}s, x{scale} {lowTime:.2f}s")
+
+    ok = True
+    for i, (fullError, lowError) in enumerate(zip(truthErrors(fullBoxes, truthBoxes), truthErrors(lowBoxes, truthBoxes))):
+        if fullError is None or lowError is None:
+            print(f"[FAIL] card {i}: missed at {'full resolution' if fullError is None else f'x{scale}'}")
+            ok = False
+            continue
+        passed = lowError <= fullError + tolerance
+        print(f"[{'OK' if passed else 'FAIL'}] card {i}: x{scale} {lowError:.1f}px off, full resolution {fullError:.1f}px off")
+        ok = ok and passed
+    return ok
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check --detect-scale crops against synthetic ground truth")
+    parser.add_argument("--detect-scale", type=float, default=0.25, help="scale to check (default: 0.25)")
+    parser.add_argument("--tolerance", type=float, default=2.0, help="max px the scaled crop may be further off the truth than the full resolution one (default: 2)")
+    parser.add_argument("--dpi", type=int, default=300, help="scan resolution (default: 300)")
+    parser.add_argument("--cards", type=int, default=6, help="cards per scan (default: 6)")
+    parser.add_argument("--background", default="gray", choices=syntheticScans.backgrounds)
+    parser.add_argument("--scans", type=int, default=4, help="scan pairs to check (default: 4)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    results = []
+    for n in range(args.scans):
+        front, back, truth = syntheticScans.generatePair(args.seed + n, dpi=args.dpi, cards=args.cards, kind=args.background)
+        for side, image in (("front", front), ("back", back)):
+            name = f"sc{n + 1:02d}-{side} ({args.dpi}dpi, seed {args.seed + n})"
+            results.append(checkScan(name, image, truth[side], args.detect_scale, args.tolerance))
+    print(f"\n[COMPLETE] {sum(results)}/{len(results)} scans at most {args.tolerance}px further off the truth than full resolution")
+    sys.exit(0 if all(results) else 1)
@@ -0,0 +1,103 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import combiner
+import debugOutput
+import detector
+import orientation
+import pipeline
+import syntheticScans
+
+# ======= PIPELINE ORDER CHECK ======= #
+# Runs scan-master's DAG on synthetic scan pairs in a scratch folder and checks
+# that there is no barrier between detection and combining: the first scan has
+# to be combined before the last detection finishes. Exits non-zero if it isn't.
+# With --memory it instead runs scan-master.py on the same scans in a fresh
+# process per mode (default DAG and --stream) and prints each one's peak RSS.
+
+events = []  # (seconds since start, what)
+lock = threading.Lock()
+start = None
+
+
+def record(what, fn):
+    def wrapped(*args, **kwargs):
+        out = fn(*args, **kwargs)
+        with lock:
+            events.append((time.time() - start, what(*args)))
+        return out
+
+    return wrapped
+
+
+def checkOrder(scans, workers, dpi, cards):
+    global start
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workDir:
+        os.chdir(workDir)
+        try:
+            os.makedirs(detector.inputDir)
+            for n in range(scans):
+                syntheticScans.writePair(detector.inputDir, n + 1, n, dpi=dpi, cards=cards)
+
+            detector.processScan = record(lambda path, side, **kw: f"detect {os.path.basename(path)}", detector.processScan)
+            combiner.combineScan = record(lambda prefix, *rest: f"combine {prefix}", combiner.combineScan)
+            start = time.time()
+            pipeline.runPipeline(workers=workers)
+        finally:
+            os.chdir(cwd)
+
+    detects = [t for t, what in events if what.startswith("detect")]
+    firstCombine = next((t for t, what in events if what == "combine sc01"), None)
+    print(f"\n[INFO] {len(detects)} detections, last done at {max(detects):.2f}s")
+    if firstCombine is None:
+        print("[FAIL] sc01 was never combined")
+        return False
+    ok = firstCombine < max(detects)
+    print(f"[{'OK' if ok else 'FAIL'}] sc01 combined at {firstCombine:.2f}s")
+    return ok
+
+
+def peakRss(scanDir, modeArgs, workers):
+    # peak RSS in MB of one scan-master.py run on a copy of scanDir
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "scan-master.py")
+    with tempfile.TemporaryDirectory() as workDir:
+        shutil.copytree(scanDir, os.path.join(workDir, detector.inputDir))
+        cmd = [sys.executable, script, "--workers", str(workers), "--debug-level", "none", "--no-osd", *modeArgs]
+        process = subprocess.Popen(cmd, cwd=workDir, stdout=subprocess.DEVNULL)
+        _, status, usage = os.wait4(process.pid, 0)
+        if status:
+            raise RuntimeError(f"{' '.join(cmd)} failed")
+    # ru_maxrss is in KiB on Linux
+    return usage.ru_maxrss / 1024
+
+
+def checkMemory(scans, workers, dpi, cards):
+    with tempfile.TemporaryDirectory() as scanDir:
+        for n in range(scans):
+            syntheticScans.writePair(scanDir, n + 1, n, dpi=dpi, cards=cards)
+        for name, modeArgs in (("default", []), ("--stream", ["--stream"])):
+            print(f"[INFO] {name}: peak RSS {peakRss(scanDir, modeArgs, workers):.0f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that scan-master combines scans while others are still detected")
+    parser.add_argument("--scans", type=int, default=10, help="synthetic scan pairs (default: 10)")
+    parser.add_argument("--workers", type=int, default=2, help="pipeline threads (default: 2)")
+    parser.add_argument("--dpi", type=int, default=150, help="scan resolution (default: 150)")
+    parser.add_argument("--cards", type=int, default=4, help="cards per scan (default: 4)")
+    parser.add_argument("--memory", action="store_true", help="print the peak RSS of the default mode and --stream instead")
+    args = parser.parse_args()
+    debugOutput.configure(level="none")
+    orientation.configure(useOSD=False)
+
+    if args.memory:
+        checkMemory(args.scans, args.workers, args.dpi, args.cards)
+        sys.exit(0)
+    sys.exit(0 if checkOrder(args.scans, args.workers, args.dpi, args.cards) else 1)
@@ -0,0 +1,307 @@
+import cv2
+import numpy as np
+import os
+import re
+import threading
+
+import cardCache
+import cardStore
+import debugOutput
+import imageWriter
+import metrics
+import orientation
+
+# ======= FRONT/BACK COMBINER ======= #
+# Shared by combine-v4.py and the in-process pipeline. combineScan() handles a
+# single scan pair and returns its matches instead of mutating globals, so scans
+# can be combined concurrently and reported together by finishReport().
+
+# === Paths ===
+frontImageDir = "output/front"
+backImageDir = "output/back"
+inputScanDir = "_INPUT"
+visualOutputDir = "debug/final"
+outputDir = "output/final"
+
+# === For image saving and stacking ===
+DPI = 250
+WIDTH = int(8.5 * DPI)  # 8.5x11in sheet as pixels
+HEIGHT = int(11 * DPI)
+backgroundTile = 256  # px, the noise pattern repeats every tile
+
+backgroundLock = threading.Lock()
+backgroundPage = None
+
+
+def setupDirs():
+    if debugOutput.enabled():
+        os.makedirs(visualOutputDir, exist_ok=True)
+    os.makedirs(outputDir, exist_ok=True)
+
+
+def loadCoords():
+    return cardStore.loadCoords("front"), cardStore.loadCoords("back")
+
+
+def scanNumber(scanPrefix):
+    match = re.search(r"sc(\d+)", scanPrefix.lower())
+    return int(match.group(1)) if match else float("inf")
+
+
+# === IoU-style matcher ===
+matchHalf = 150 # how big the boxes are going to be. Value * 2 H and W
+
+
+def overlapMatrix(frontCards, backCards, half=matchHalf):
+    # Overlap area of every front box with every back box. Both are axis-aligned
+    # squares of the same size, so it is just the product of the 1D overlaps.
+    front = np.array([[c["x"], c["y"]] for c in frontCards.values()], dtype=np.float64).reshape(-1, 2)
+    back = np.array([[c["x"], c["y"]] for c in backCards.values()], dtype=np.float64).reshape(-1, 2)
+    span = 2 * half
+    dx = np.clip(span - np.abs(front[:, None, 0] - back[None, :, 0]), 0, None)
+    dy = np.clip(span - np.abs(front[:, None, 1] - back[None, :, 1]), 0, None)
+    return dx * dy
+
+
+def matchCards(frontCards, backCards):
+    # One-to-one assignment, greedy on the overlap matrix: take the biggest
+    # overlap left, retire that front and back, repeat. Fronts that only overlap
+    # with backs already claimed by someone else come back as (front, None, 0).
+    frontIDs, backIDs = list(frontCards), list(backCards)
+    overlap = overlapMatrix(frontCards, backCards)
+
+    assigned = {}
+    takenBacks = set()
+    for flat in np.argsort(-overlap, axis=None, kind="stable"):
+        f, b = divmod(int(flat), len(backIDs))
+        if overlap[f, b] <= 0:
+            break
+        if f in assigned or b in takenBacks:
+            continue
+        assigned[f] = b
+        takenBacks.add(b)
+
+    return [
+        (frontID, backIDs[assigned[f]], float(overlap[f, assigned[f]]))
+        if f in assigned
+        else (frontID, None, 0.0)
+        for f, frontID in enumerate(frontIDs)
+    ]
+
+
+def horizontalOrient(image):
+    if image.shape[0] > image.shape[1]:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    return image
+
+
+def pageBackground():
+    # The light noise every page is drawn on, built once from a small random
+    # tile. Pages start as a copy of it, so no noise is generated per card.
+    # The tile is seeded: the same cards always give a byte-identical page,
+    # which the analysis caches key on.
+    global backgroundPage
+    with backgroundLock:
+        if backgroundPage is None:
+            tile = np.random.default_rng(0).integers(43, 47, (backgroundTile, backgroundTile, 3), dtype=np.uint8)
+            reps = (-(-HEIGHT // backgroundTile), -(-WIDTH // backgroundTile), 1)
+            backgroundPage = np.tile(tile, reps)[:HEIGHT, :WIDTH]
+        return backgroundPage
+
+
+def pageLayout(frontShape, backShape, width=WIDTH, height=HEIGHT):
+    # Where each card goes on the page: stacked front over back, both centred
+    # horizontally, the stack shrunk to fit the page if needed and centred on
+    # it. -> [(x0, y0, x1, y1) for the front, for the back]
+    fh, fw = frontShape[:2]
+    bh, bw = backShape[:2]
+    stackW, stackH = max(fw, bw), fh + bh
+    spans = [((stackW - fw) // 2, 0, fw, fh), ((stackW - bw) // 2, fh, bw, bh)]
+
+    sx = sy = 1.0
+    if stackH > height or stackW > width:
+        scale = min(width / stackW, height / stackH)
+        newW, newH = int(stackW * scale), int(stackH * scale)
+        sx, sy = newW / stackW, newH / stackH
+        stackW, stackH = newW, newH
+
+    padTop = (height - stackH) // 2
+    padLeft = (width - stackW) // 2
+    return [
+        (padLeft + round(x * sx), padTop + round(y * sy), padLeft + round((x + w) * sx), padTop + round((y + h) * sy))
+        for x, y, w, h in spans
+    ]
+
+
+def rotateImage(image, angle):
+    # angle = clockwise turn, as orientation.orient() and tesseract's "Rotate:" give it
+    if angle == 90:
+        return cv2.rotate(image, cv2.ROTATE_90_CLOCKWISE)
+    elif angle == 180:
+        return cv2.rotate(image, cv2.ROTATE_180)
+    elif angle == 270:
+        return cv2.rotate(image, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return image
+
+
+def loadPair(frontCardID, bestMatch):
+    # in-memory handoff from the scanner when running in-process, else load back the images again
+    frontCardPath = os.path.join(frontImageDir, f"{frontCardID}_front.png")
+    backCardPath = os.path.join(backImageDir, f"{bestMatch}_back.png")
+
+    frontImage = cardCache.load(("front", frontCardID), frontCardPath)
+    backImage = cardCache.load(("back", bestMatch), backCardPath)
+
+    if frontImage is None or backImage is None:
+        print(
+            f"[WARN] Missing front or back card image for {frontCardID} / {bestMatch}"
+        )  # i <3 debugging
+        return None
+    return horizontalOrient(frontImage), horizontalOrient(backImage)
+
+
+def saveComposites(pairs):
+    # pairs = [(frontCardID, frontImage, backImage), ...], all of one scan.
+    # The cards are turned upright in one batch, then composited.
+    with metrics.span("orient"):
+        turns = orientation.orient([image for _, front, back in pairs for image in (front, back)])
+    for i, (frontCardID, frontImage, backImage) in enumerate(pairs):
+        # Save final combined image using front card name
+        outFilePath = os.path.join(outputDir, f"{frontCardID}.png")
+        with metrics.span("composite"):
+            composite = buildComposite(frontImage, backImage, turns[2 * i : 2 * i + 2])
+        imageWriter.write(outFilePath, composite)
+
+
+def buildComposite(frontImage, backImage, turns=(0, 0)):
+    # front above back on an 8.5x11 page, kept apart from saveComposites so it
+    # can be timed without any file I/O (bench-suite.py). Both cards are
+    # written straight into a copy of the page background, turned clockwise
+    # by `turns` after being laid landscape.
+    frontImage = rotateImage(horizontalOrient(frontImage), turns[0])
+    backImage = rotateImage(horizontalOrient(backImage), turns[1])
+
+    page = pageBackground().copy()
+    for image, (x0, y0, x1, y1) in zip((frontImage, backImage), pageLayout(frontImage.shape, backImage.shape)):
+        if (x1 - x0, y1 - y0) != (image.shape[1], image.shape[0]):
+            # the stack was too big for the page, shrink the card into its slot
+            cv2.resize(image, (x1 - x0, y1 - y0), dst=page[y0:y1, x0:x1])
+        else:
+            page[y0:y1, x0:x1] = image
+    return page
+
+
+def saveOverlay(scanPrefix, frontCards, backCards):
+    imagePath = os.path.join(inputScanDir, f"{scanPrefix}-front.png")
+    image = cardCache.load(("scan", f"{scanPrefix}-front"), imagePath)
+
+    if image is None:
+        print(f"[ERROR] Could not read image: {imagePath}")
+        return
+
+    # full resolution, or a thumbnail at debug level `summary`
+    scale = debugOutput.scaleFor(image)
+    image = debugOutput.thumbnail(image)
+    overlay = image.copy()
+    half = int(125 * scale)
+
+    # Draw front (red) and back (blue) boxes
+    for coords in frontCards.values():
+        fx, fy = int(coords["x"] * scale), int(coords["y"] * scale)
+        cv2.rectangle(
+            overlay, (fx - half, fy - half), (fx + half, fy + half), (0, 0, 255), -1
+        )
+
+    for coords in backCards.values():
+        bx, by = int(coords["x"] * scale), int(coords["y"] * scale)
+        cv2.rectangle(
+            overlay, (bx - half, by - half), (bx + half, by + half), (255, 0, 0), -1
+        )
+
+    # Blend and save
+    blended = cv2.addWeighted(overlay, 0.4, image, 0.6, 0)
+    outPath = os.path.join(visualOutputDir, f"{scanPrefix}_boxes.png")
+    imageWriter.write(outPath, blended, debug=True)
+
+
+def combineScan(scanPrefix, frontCards, backCards):
+    result = {
+        "scanPrefix": scanPrefix,
+        "matches": [],
+        "composites": [],
+        "weakCardMatches": [],
+        "weakScanMatches": [],
+        "noScanMatches": [],
+    }
+
+    print(f"[INFO] Matching cards from {scanPrefix}...")
+
+    with metrics.scope(scanPrefix):
+        # Match cards
+        with metrics.span("match"):
+            matches = matchCards(frontCards, backCards)
+        cardStore.saveMatches(scanPrefix, [m for m in matches if m[1] is not None])
+        pairs = []
+        for frontCardID, bestMatch, area in matches:
+            if bestMatch is None:
+                result["weakCardMatches"].append(frontCardID)
+                result["noScanMatches"].append(scanPrefix)
+                continue
+
+            print(f"→ {frontCardID} ⇔ {bestMatch} (Overlap area = {area:.2f})")
+            result["matches"].append((frontCardID, bestMatch))
+
+            # track weak matches as well as plain old `none`s
+            if area < 10000:
+                result["weakCardMatches"].append(frontCardID)
+                result["weakScanMatches"].append(scanPrefix)
+
+            if area >= 5000:
+                images = loadPair(frontCardID, bestMatch)
+                if images is not None:
+                    pairs.append((frontCardID, *images))
+                    result["composites"].append(os.path.join(outputDir, f"{frontCardID}.png"))
+        if pairs:
+            saveComposites(pairs)
+
+        # the raw scan is only needed for the overlay, skip reading it at debug level `none`
+        if debugOutput.enabled():
+            with debugOutput.timed(), metrics.span("overlay"):
+                saveOverlay(scanPrefix, frontCards, backCards)
+    return result
+
+
+def finishReport(results):
+    # results may arrive in any order when scans are combined concurrently
+    results = sorted(results, key=lambda r: scanNumber(r["scanPrefix"]))
+
+    # Deduplicate <- goated word
+    weakScanMatches = sorted({s for r in results for s in r["weakScanMatches"]})
+    weakCardMatches = sorted({c for r in results for c in r["weakCardMatches"]})
+    noScanMatches = sorted({s for r in results for s in r["noScanMatches"]})
+
+    print(f"\n[DEBUG] {len(weakScanMatches)} scans with weak matches: {weakScanMatches}")
+    print(f"[DEBUG] {len(weakCardMatches)} cards with weak matches: {weakCardMatches}")
+    print(f"[DEBUG] {len(noScanMatches)} scans with NO matches: {noScanMatches}")
+
+
+def combineAll():
+    setupDirs()
+    frontData, backData = loadCoords()
+
+    results = []
+    for frontScanKey, frontCards in frontData.items():
+        scanPrefix = frontScanKey.replace("-front", "")
+        backScanKey = f"{scanPrefix}-back"
+
+        if backScanKey not in backData:
+            print(f"[WARN] No matching back scan for {frontScanKey}")
+            continue
+
+        results.append(combineScan(scanPrefix, frontCards, backData[backScanKey]))
+
+    imageWriter.flush()
+    finishReport(results)
+    debugOutput.report()
+    metrics.report()
+    return results
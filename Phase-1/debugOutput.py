@@ -0,0 +1,86 @@
+import cv2
+import threading
+import time
+from contextlib import contextmanager
+
+# ======= DEBUG ARTIFACT LEVEL ======= #
+# One setting shared by every stage:
+#   none    - no debug images are allocated, drawn or encoded
+#   summary - debug images are drawn on a downscaled thumbnail only
+#   full    - full resolution debug images (the old behaviour)
+# Time spent on debug output is tallied so each run can report what it cost.
+
+levels = ("none", "summary", "full")
+level = "full"
+thumbWidth = 800  # px, width of summary thumbnails
+
+lock = threading.Lock()
+overhead = 0.0
+
+
+def settings():
+    return {"level": level, "thumbWidth": thumbWidth}
+
+
+def configure(**kwargs):
+    global level, thumbWidth
+    level = kwargs.get("level") or level
+    thumbWidth = kwargs.get("thumbWidth") or thumbWidth
+
+
+def addArguments(parser):
+    parser.add_argument(
+        "--debug-level",
+        choices=levels,
+        default=None,
+        help="none: skip debug images, summary: thumbnails only, full: full resolution (default: full)",
+    )
+
+
+def configureFromArgs(args):
+    configure(level=args.debug_level)
+
+
+def enabled():
+    return level != "none"
+
+
+def scaleFor(image):
+    # factor to draw debug output at, relative to `image`
+    if level == "full":
+        return 1.0
+    return min(1.0, thumbWidth / image.shape[1])
+
+
+def canvas(image):
+    # a private copy of `image` to draw on, downscaled at summary level
+    scale = scaleFor(image)
+    if scale == 1.0:
+        return image.copy(), scale
+    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA), scale
+
+
+def thumbnail(image):
+    # like canvas(), but hands back `image` itself when no copy is needed
+    if scaleFor(image) == 1.0:
+        return image
+    return canvas(image)[0]
+
+
+def addOverhead(seconds):
+    global overhead
+    with lock:
+        overhead += seconds
+
+
+@contextmanager
+def timed():
+    start = time.time()
+    try:
+        yield
+    finally:
+        addOverhead(time.time() - start)
+
+
+def report():
+    print(f"[TIME] Debug output ({level}) took: {overhead:.2f}s")
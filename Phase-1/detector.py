@@ -0,0 +1,707 @@
+import cv2
+import numpy as np
+import os
+import glob
+import hashlib
+import re
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from multiprocessing import Pool
+from multiprocessing.util import Finalize
+
+import cardCache
+import cardStore
+import debugOutput
+import imageWriter
+import metrics
+
+# ======= SCAN DETECTION ENGINE ======= #
+# Shared by front-scanner-v4.py and back-scanner-v4.py. Each scan is processed
+# by processScan(), which touches no globals, so scans can be fanned out across
+# a worker pool. Results are merged back in scan order by commitScan(), which is
+# the only place card numbers (cardNNNN) get handed out.
+
+inputDir = "_INPUT"
+
+logDebug = False
+padSize = 20
+resizeFactor = 0.75
+detectScale = None  # e.g. 0.25: detect on a small copy, refine and warp at full resolution
+refineMargin = 6  # px around each upscaled contour searched when refining
+reuseBuffers = False  # keep the scratch buffers per thread between scans: saves allocation time, not memory
+adaptive = False  # retry scans with fewer than expectedCards cards over retryVariants
+expectedCards = 6
+retryScale = 0.25  # the retries run the low-res pipeline, at detectScale if that is set
+retryThreads = 4
+consolePrintAll = True
+
+z, t = 30, 55
+lowerGray = np.array([z, z, z])
+upperGray = np.array([t, t, t])
+
+# Gray background range, Canny thresholds, closing kernel (px at resizeFactor)
+# and detection scale tried on scans that come up short. The one that finds
+# the most cards wins, ties go to the larger total card area, and it is only
+# kept if it finds more cards than the first pass did. Without a
+# "scale" the retry runs at detectScale, or retryScale if that is not set.
+retryVariants = [
+    {"gray": (z, t), "canny": (50, 150), "kernel": 21},
+    {"gray": (z, t), "canny": (25, 80), "kernel": 13},
+    {"gray": (z, t), "canny": (80, 200), "kernel": 9},
+    {"gray": (z - 10, t + 10), "canny": (50, 150), "kernel": 13},
+    {"gray": (z + 10, t - 10), "canny": (50, 150), "kernel": 13},
+    {"gray": (z, t), "canny": (50, 150), "kernel": 5, "scale": 0.5},
+    {"gray": (z - 10, t + 10), "canny": (25, 80), "kernel": 9, "scale": 0.5},
+    {"gray": (z - 10, t + 10), "canny": (25, 80), "kernel": 21},
+]
+
+buffers = threading.local()  # per thread, the in-process pipeline detects on a thread pool
+
+
+def sidePaths(side):
+    title = side.capitalize()
+    return {
+        "outputDir": f"output/{side}",
+        "debugBaseDir": f"debug/{side}",
+        "contourDebugPath": f"debug/contours{title}.txt",
+    }
+
+
+def extractNumber(filename, side):
+    match = re.search(rf"sc(\d+)[_-]{side}", filename.lower())
+    return int(match.group(1)) if match else float("inf")
+
+
+def listScans(side):
+    inputFiles = glob.glob(os.path.join(inputDir, "*.png"))
+    inputFiles = [p for p in inputFiles if side in p.lower()]
+    return sorted(inputFiles, key=lambda p: extractNumber(p, side))
+
+
+def settings():
+    return {"detectScale": detectScale, "adaptive": adaptive}
+
+
+def configure(**kwargs):
+    global detectScale, adaptive
+    detectScale = kwargs.get("detectScale") or detectScale
+    adaptive = kwargs.get("adaptive", adaptive)
+
+
+def addArguments(parser):
+    parser.add_argument(
+        "--detect-scale",
+        type=float,
+        default=None,
+        help="find contours on a copy scaled by this factor (e.g. 0.25), only the final warp runs at full resolution",
+    )
+    parser.add_argument(
+        "--adaptive",
+        action="store_true",
+        help=f"re-detect scans with fewer than {expectedCards} cards over a sweep of thresholds and kernels, keep the best",
+    )
+
+
+def configureFromArgs(args):
+    configure(detectScale=args.detect_scale, adaptive=args.adaptive)
+
+
+# === STATE ===
+# cardStore records, per scan, the hash of the input file and of the detector
+# parameters it was cropped with, plus the cards it produced. A scan is written
+# there in one transaction as soon as it is committed, so an interrupted batch
+# resumes where it stopped, and a scan is only redone when its file or the
+# parameters change. A redone scan keeps its card numbers.
+
+
+def detectorParams():
+    params = {
+        "padSize": padSize,
+        "resizeFactor": resizeFactor,
+        "detectScale": detectScale,
+        "refineMargin": refineMargin,
+        "gray": [z, t],
+        "adaptive": retryVariants if adaptive else None,
+    }
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def fileHash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def loadState(side):
+    paths = sidePaths(side)
+    os.makedirs(paths["outputDir"], exist_ok=True)
+    os.makedirs(paths["debugBaseDir"], exist_ok=True)
+
+    return {
+        "side": side,
+        "paths": paths,
+        "params": detectorParams(),
+        "pending": {},
+        "index": cardStore.nextCard(side),
+        "scans": cardStore.loadScans(side),
+        "contourCoords": cardStore.loadCoords(side),
+    }
+
+
+def saveState(state):
+    # everything else is already in cardStore, this is only the debug summary
+    with open(state["paths"]["contourDebugPath"], "w") as f:
+        f.write("\n".join(f"{name}: {len(entry['cards'])}" for name, entry in sorted(state["scans"].items())))
+
+
+def needsScan(state, inputPath, quiet=False):
+    # True if the scan has to be (re)detected. Hashes the file, the result is
+    # kept for commitScan() to record. quiet drops the per-scan [SKIP] lines.
+    baseName = os.path.splitext(os.path.basename(inputPath))[0]
+    entry = state["scans"].get(baseName)
+    stat = os.stat(inputPath)
+    stamp = [stat.st_size, stat.st_mtime_ns]
+    if entry and entry.get("stamp") == stamp and entry["hash"]:
+        # untouched since it was hashed, skip re-reading it
+        digest = entry["hash"]
+    else:
+        digest = fileHash(inputPath)
+    key = {"hash": digest, "params": state["params"], "stamp": stamp}
+    state["pending"][baseName] = key
+
+    if entry is None:
+        return True
+    if entry["hash"] is None:
+        # imported from the old counters
+        entry.update(key)
+        cardStore.updateScanKey(state["side"], baseName, entry)
+        if not quiet:
+            print(f"[SKIP] {baseName} already processed")
+        return False
+    if entry["hash"] != key["hash"]:
+        print(f"[INFO] {baseName} changed since it was cropped, redoing it")
+        return True
+    if entry["params"] != key["params"]:
+        print(f"[INFO] {baseName} was cropped with other detector settings, redoing it")
+        return True
+    outputDir = state["paths"]["outputDir"]
+    side = state["side"]
+    if entry["written"] and not all(
+        os.path.exists(os.path.join(outputDir, f"{card}_{side}.png")) for card in entry["cards"]
+    ):
+        print(f"[INFO] {baseName} is missing cropped cards, redoing it")
+        return True
+    if not quiet:
+        print(f"[SKIP] {baseName} already processed")
+    return False
+
+
+def cardNames(state, baseName, count):
+    # a redone scan reuses its old card numbers, new ones are only handed out
+    # for cards it did not have before
+    entry = state["scans"].get(baseName)
+    names = list(entry["cards"][:count]) if entry else []
+    while len(names) < count:
+        names.append(f"card{state['index']:04d}")
+        state["index"] += 1
+    if entry:
+        side = state["side"]
+        for stale in entry["cards"][count:]:
+            stalePath = os.path.join(state["paths"]["outputDir"], f"{stale}_{side}.png")
+            if os.path.exists(stalePath):
+                os.remove(stalePath)
+    return names
+
+
+# === DETECTION ===
+def findPostcardContours(image):
+    if detectScale:
+        detection = findPostcardContoursLowRes(image, detectScale)
+    else:
+        detection = findPostcardContoursFullRes(image)
+    if adaptive and len(detection["postcardContours"]) < expectedCards:
+        detection = retryDetection(image, detection)
+    detection["geometry"] = [cardGeometry(cnt) for cnt in detection["cardContours"]]
+    return detection
+
+
+def cardGeometry(contour):
+    # Everything the debug overlay, the card records and the warp need from one
+    # card contour (padded full resolution coordinates), worked out once.
+    M = cv2.moments(contour)
+    rect = cv2.minAreaRect(contour)
+    width, height = int(rect[1][0]), int(rect[1][1])
+    return {
+        "x": int(M["m10"] / M["m00"]) if M["m00"] != 0 else 0,
+        "y": int(M["m01"] / M["m00"]) if M["m00"] != 0 else 0,
+        "bounds": cv2.boundingRect(contour),
+        "box": cv2.boxPoints(rect).astype(np.intp),
+        "width": width,
+        "height": height,
+        "portrait": height > width,
+    }
+
+
+def detectionScore(detection):
+    # more cards first, then more of the scan covered by them
+    return (len(detection["cardContours"]), sum(cv2.contourArea(c) for c in detection["cardContours"]))
+
+
+def retryDetection(image, detection):
+    # Only for scans that came up short: run the low-res pipeline once per
+    # retry variant, on a thread pool (OpenCV drops the GIL), and keep the best.
+    # Each thread masks into its own scratch buffers.
+    item = metrics.currentItem()
+
+    def attempt(variant):
+        with metrics.scope(item):
+            return findPostcardContoursLowRes(image, variant.get("scale", detectScale or retryScale), variant)
+
+    with metrics.span("retry"), ThreadPoolExecutor(
+        max_workers=min(retryThreads, len(retryVariants)), thread_name_prefix="retry"
+    ) as pool:
+        attempts = list(pool.map(attempt, retryVariants))
+
+    found = len(detection["postcardContours"])
+    best, variant = max(zip(attempts, retryVariants), key=lambda pair: detectionScore(pair[0]))
+    if len(best["postcardContours"]) <= found:
+        best, variant = detection, None
+    best["retried"] = found
+    best["variant"] = variant
+    return best
+
+
+def grayRange(gray):
+    if gray is None:
+        return lowerGray, upperGray
+    return np.array([gray[0]] * 3), np.array([gray[1]] * 3)
+
+
+def scratch(name, shape):
+    # A uint8 buffer, fresh per scan unless reuseBuffers keeps one per thread
+    # for as long as scans keep the same size
+    if not reuseBuffers:
+        return np.empty(shape, np.uint8)
+    buf = getattr(buffers, name, None)
+    if buf is None or buf.shape != shape:
+        buf = np.empty(shape, np.uint8)
+        setattr(buffers, name, buf)
+    return buf
+
+
+def maskBackground(image, pad, gray=None):
+    # Pad `image` and black out the gray background, in one buffer.
+    # Padding with black gives the same result as the old noise fill: the noise
+    # was background gray, so it got masked to black anyway.
+    lower, upper = grayRange(gray)
+    h, w = image.shape[:2]
+    with metrics.span("pad"):
+        padded = scratch("padded", (h + 2 * pad, w + 2 * pad, 3))
+        cv2.copyMakeBorder(image, pad, pad, pad, pad, cv2.BORDER_CONSTANT, dst=padded, value=0)
+    with metrics.span("mask"):
+        grayMask = cv2.inRange(padded, lower, upper, dst=scratch("grayMask", padded.shape[:2]))
+        # zero the masked pixels in place, no inverted mask or second image needed
+        cv2.subtract(padded, padded, dst=padded, mask=grayMask)
+    return padded
+
+
+def findPostcardContoursFullRes(image):
+    # Pad and mask gray background
+    maskedImage = maskBackground(image, padSize)
+
+    # Resize and preprocess
+    with metrics.span("resize"):
+        resized = cv2.resize(maskedImage, (0, 0), fx=resizeFactor, fy=resizeFactor)
+    with metrics.span("edge"):
+        gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+        edges = cv2.Canny(blurred, 50, 150)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (13, 13))
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+
+    detection = filterContours(closed, resizeFactor)
+    detection["resized"] = resized
+    # contours are found at `resizeFactor`, scale them back up to the padded scan
+    detection["cardContours"] = [
+        (cnt / resizeFactor).astype(np.int32) for cnt in detection["postcardContours"]
+    ]
+    # the padded buffer has been masked, warp from the scan itself
+    detection["warpSource"] = image
+    detection["warpOffset"] = padSize
+    return detection
+
+
+def findPostcardContoursLowRes(image, scale, variant=None):
+    # Same steps as findPostcardContoursFullRes, but padding, masking, Canny,
+    # morphology and findContours all run on a copy scaled by `scale`. Each
+    # contour is then refined against the full resolution scan around it, and
+    # warpCards() samples the unpadded scan, so no full resolution frame is
+    # padded or masked. `variant` overrides the gray range, Canny thresholds
+    # and kernel size (see retryVariants).
+    variant = variant or {}
+    with metrics.span("resize"):
+        small = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    pad = max(1, round(padSize * scale))
+    resized = maskBackground(small, pad, variant.get("gray"))
+    with metrics.span("edge"):
+        gray = cv2.cvtColor(resized, cv2.COLOR_BGR2GRAY)
+        blurred = cv2.GaussianBlur(gray, (3, 3), 0)
+        edges = cv2.Canny(blurred, *variant.get("canny", (50, 150)))
+        # the closing kernel is 13px at resizeFactor, keep it the same size on the scan
+        k = max(3, int(round(variant.get("kernel", 13) * scale / resizeFactor)) | 1)
+        kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (k, k))
+        closed = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, kernel)
+
+    detection = filterContours(closed, scale)
+    detection["resized"] = resized
+
+    with metrics.span("refine"):
+        detection["cardContours"] = [
+            refineContour(image, (cnt - pad) / scale, scale, variant.get("gray")) + padSize
+            for cnt in detection["postcardContours"]
+        ]
+    detection["warpSource"] = image
+    detection["warpOffset"] = padSize
+    return detection
+
+
+def contourStats(contours):
+    # Area and bounding box (x, y, w, h) of every contour, as arrays. All points
+    # are stacked into one array and reduced per contour, so noisy scans with
+    # thousands of contours cost a few NumPy calls instead of a Python loop.
+    if not contours:
+        return np.zeros(0), np.zeros((0, 4), np.int64)
+    lengths = np.fromiter(map(len, contours), np.intp, len(contours))
+    points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+
+    # shoelace formula, each contour closed back onto its first point
+    following = np.arange(1, len(points) + 1)
+    following[starts + lengths - 1] = starts
+    x, y = points[:, 0], points[:, 1]
+    cross = x * y[following] - x[following] * y
+    areas = np.abs(np.add.reduceat(cross, starts)) / 2
+
+    low = np.minimum.reduceat(points, starts)
+    high = np.maximum.reduceat(points, starts)
+    return areas, np.hstack([low, high - low + 1])
+
+
+def topByArea(indices, areas, k):
+    # the k largest of `indices`, largest first, ties in contour order
+    if len(indices) > k:
+        indices = np.sort(indices[np.argpartition(-areas[indices], k - 1)[:k]])
+    return indices[np.argsort(-areas[indices], kind="stable")]
+
+
+def filterContours(closed, scale):
+    # Only outer contours are candidates, so RETR_EXTERNAL finds exactly those
+    # and skips building the hierarchy.
+    with metrics.span("contours"):
+        contours, _ = cv2.findContours(closed, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    # Filter contours based on area and aspect.
+    # The area limit is 40000px at resizeFactor, scaled to the image searched.
+    with metrics.span("filter"):
+        minArea = 40000 * (scale / resizeFactor) ** 2
+        areas, boxes = contourStats(contours)
+        aspects = np.divide(boxes[:, 2], boxes[:, 3], out=np.zeros(len(boxes)), where=boxes[:, 3] != 0)
+        keep = np.flatnonzero((areas > minArea) & (aspects > 0.59) & (aspects < 3.0))
+
+        # Sort and limit to top 6 postcard contours
+        postcardContours = [contours[i] for i in topByArea(keep, areas, 6)]
+
+    return {
+        "closed": closed,
+        "contours": contours,
+        "areas": areas,
+        "boxes": boxes,
+        "aspects": aspects,
+        "postcardContours": postcardContours,
+    }
+
+
+def refineContour(image, approx, scale, gray=None):
+    # Snap a contour found on the downscaled copy (`approx`, already in full
+    # resolution scan coordinates) to the card edge at full resolution. Only a
+    # band around the contour is searched, so neighbouring cards are ignored.
+    # Falls back to the upscaled contour if nothing sensible is found there.
+    approx = np.round(approx).astype(np.int32)
+    margin = int(np.ceil(2 / scale)) + refineMargin
+    h, w = image.shape[:2]
+    x, y, wBox, hBox = cv2.boundingRect(approx)
+    x0, y0 = max(0, x - margin), max(0, y - margin)
+    x1, y1 = min(w, x + wBox + margin), min(h, y + hBox + margin)
+    local = approx - (x0, y0)
+
+    roi = image[y0:y1, x0:x1]
+    foreground = cv2.bitwise_not(cv2.inRange(roi, *grayRange(gray)))
+    foreground = cv2.morphologyEx(foreground, cv2.MORPH_OPEN, np.ones((3, 3), np.uint8))
+    band = np.zeros(foreground.shape, np.uint8)
+    cv2.drawContours(band, [local], -1, 255, cv2.FILLED)
+    cv2.drawContours(band, [local], -1, 255, 2 * margin)
+    cv2.bitwise_and(foreground, band, dst=foreground)
+
+    contours, _ = cv2.findContours(foreground, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return approx
+    best = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(best) < 0.9 * cv2.contourArea(local):
+        return approx
+    # filling the whole band means the background isn't the gray being masked
+    # (a black lid), there is no edge to snap to here
+    if cv2.contourArea(best) > 0.98 * cv2.countNonZero(band):
+        return approx
+    return best + (x0, y0)
+
+
+def saveDebugImages(debugDir, detection):
+    # nothing is allocated or drawn at debug level `none`
+    if not debugOutput.enabled():
+        return
+    os.makedirs(debugDir, exist_ok=True)
+    postcardContours = detection["postcardContours"]
+
+    # ALWAYS save cardContours.png — the top (not always 6) strongest contours
+    cardContoursDebug, scale = debugOutput.canvas(detection["warpSource"])
+    offset = detection["warpOffset"]
+    for i, card in enumerate(detection["geometry"]):
+        bx, by, bw, bh = card["bounds"]
+        x, y = int((bx - offset) * scale), int((by - offset) * scale)
+        wBox, hBox = int(bw * scale), int(bh * scale)
+        cv2.rectangle(cardContoursDebug, (x, y), (x + wBox, y + hBox), (0, 255, 0), 2)
+        cv2.putText(
+            cardContoursDebug,
+            str(i),
+            (x, y - 5),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.8,
+            (0, 255, 0),
+            2,
+        )
+    imageWriter.write(os.path.join(debugDir, "cardContours.png"), cardContoursDebug, debug=True)
+
+    # Save debug images only if fewer than 6 postcard contours found. Assumes that 6 is the propper number.
+    if len(postcardContours) < 6:
+        closedDebug = debugOutput.thumbnail(detection["closed"])
+        imageWriter.write(os.path.join(debugDir, "closedBoxes.png"), closedDebug, debug=True)
+
+        # Draw and save `topContours.png` (top 10 largest contours)
+        areas = detection["areas"]
+        topContours = topByArea(np.arange(len(areas)), areas, 10)
+        topContoursDebug, scale = debugOutput.canvas(detection["resized"])
+        for i, c in enumerate(topContours):
+            x, y, wBox, hBox = (detection["boxes"][c] * scale).astype(int)
+            cv2.rectangle(
+                topContoursDebug, (x, y), (x + wBox, y + hBox), (255, 0, 255), 2
+            )
+            cv2.putText(
+                topContoursDebug,
+                f"#{i} A={int(areas[c])}",
+                (x, y - 10),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                0.6,
+                (255, 0, 255),
+                2,
+            )
+        imageWriter.write(os.path.join(debugDir, "topContours.png"), topContoursDebug, debug=True)
+
+        # save contour info/data
+        with open(os.path.join(debugDir, "contourData.txt"), "w") as f:
+            for i, (area, aspect, box) in enumerate(zip(areas, detection["aspects"], detection["boxes"])):
+                f.write(f"Contour {i}: Area={area:.2f}, Aspect={aspect:.2f}, Box={tuple(box.tolist())}\n")
+
+
+def warpCards(source, geometry, offset=0):
+    # centroid + warped (landscape) crop for each card from cardGeometry(). Boxes
+    # are in padded scan coordinates, `source` starts `offset` pixels into that
+    # frame. Portrait cards get their 90 degree turn folded into the destination
+    # corners, so warpPerspective writes the landscape crop directly.
+    cards = []
+    for card in geometry:
+        width, height = card["width"], card["height"]
+        if width == 0 or height == 0:
+            print("[WARN] Skipping contour with zero width/height")
+            continue
+
+        srcPts = card["box"].astype("float32") - offset
+        if card["portrait"]:
+            # the corners of the upright crop, turned clockwise
+            dstPts = np.array(
+                [[0, 0], [height - 1, 0], [height - 1, width - 1], [0, width - 1]],
+                dtype="float32",
+            )
+            size = (height, width)
+        else:
+            dstPts = np.array(
+                [[0, height - 1], [0, 0], [width - 1, 0], [width - 1, height - 1]],
+                dtype="float32",
+            )
+            size = (width, height)
+        M = cv2.getPerspectiveTransform(srcPts, dstPts)
+        warped = cv2.warpPerspective(source, M, size, borderMode=cv2.BORDER_REPLICATE)
+
+        cards.append({"x": card["x"], "y": card["y"], "box": card["box"].tolist(), "warped": warped})
+    return cards
+
+
+def processScan(inputPath, side, keepImages=False):
+    # Worker: detect + warp one scan. Cards are written under a per-scan staging
+    # name, commitScan() renames them to their final cardNNNN name. With
+    # keepImages (in-process callers only) the warped cards and the raw scan are
+    # returned as arrays instead and nothing is written here.
+    paths = sidePaths(side)
+    baseName = os.path.splitext(os.path.basename(inputPath))[0]
+    result = {"inputPath": inputPath, "baseName": baseName, "cards": []}
+
+    startTime = time.time()
+    with metrics.scope(baseName):
+        image = metrics.imread(inputPath)
+        if image is None:
+            result["error"] = f"Cannot open {inputPath}"
+            return result
+
+        with metrics.span("detect"):
+            detection = findPostcardContours(image)
+        result["found"] = len(detection["contours"])
+        result["candidates"] = len(detection["postcardContours"])
+        if "retried" in detection:
+            result["retry"] = {"before": detection["retried"], "variant": detection["variant"]}
+
+        debugT = time.time()
+        with metrics.span("debug"):
+            saveDebugImages(os.path.join(paths["debugBaseDir"], baseName), detection)
+        result["debugTime"] = time.time() - debugT
+
+        with metrics.span("warp"):
+            cards = warpCards(detection["warpSource"], detection["geometry"], detection["warpOffset"])
+        if keepImages:
+            result["scanImage"] = image
+            result["cards"] = cards
+        else:
+            stagingDir = os.path.join(paths["outputDir"], ".staging")
+            os.makedirs(stagingDir, exist_ok=True)
+            writes = []
+            for k, card in enumerate(cards):
+                stagedPath = os.path.join(stagingDir, f"{baseName}-{k}.png")
+                writes.append(imageWriter.write(stagedPath, card["warped"]))
+                result["cards"].append({"x": card["x"], "y": card["y"], "box": card["box"], "staged": stagedPath})
+            # commitScan renames these, they have to be on disk before we hand back
+            for future in writes:
+                future.result()
+
+    result["timing"] = time.time() - startTime
+    if not keepImages:
+        # pool workers hand their spans back with the result, commitScan merges them
+        result["metrics"] = metrics.drain()
+    return result
+
+
+def commitScan(state, result, writeCards=True):
+    # Merge a worker result into the run state. Must be called in scan order.
+    # In-memory cards go to cardCache for the combiner, their PNGs are written in
+    # the background (or only if they get evicted, when writeCards is off).
+    side = state["side"]
+    baseName = result["baseName"]
+    metrics.merge(result.pop("metrics", None))
+
+    print(f"\n[PROCESSING] {result['inputPath']}")
+    if "error" in result:
+        print(f"[ERROR] {result['error']}, skipping.")
+        return
+
+    print(f"[INFO] Found {result['found']} contours")
+    print(f"[INFO] Filtered to {result['candidates']} candidate contours")
+    retry = result.get("retry")
+    if retry and retry["variant"]:
+        print(f"[INFO] Retried after {retry['before']} cards, {result['candidates']} with {retry['variant']}")
+    elif retry:
+        print(f"[WARN] Retried after {retry['before']} cards, no variant found more")
+
+    names = cardNames(state, baseName, len(result["cards"]))
+    state["contourCoords"][baseName] = {}
+    for cardName, card in zip(names, result["cards"]):
+        state["contourCoords"][baseName][cardName] = {"x": card["x"], "y": card["y"]}
+
+        outName = f"{cardName}_{side}.png"
+        outPath = os.path.join(state["paths"]["outputDir"], outName)
+        if "warped" in card:
+            # from here on cardCache (bounded) and the writer own the pixels,
+            # the result must not keep them alive for the rest of the run
+            warped = card.pop("warped")
+            cardCache.put((side, cardName), warped, outPath, written=writeCards)
+            if writeCards:
+                imageWriter.write(outPath, warped)
+        else:
+            os.replace(card["staged"], outPath)
+        if consolePrintAll:
+            print(f"[SAVED] {outName}")
+
+    debugOutput.addOverhead(result.get("debugTime", 0))
+    scanImage = result.pop("scanImage", None)
+    if scanImage is not None and side == "front" and debugOutput.enabled():
+        # the combiner draws its overlay on the raw front scan
+        cardCache.put(("scan", baseName), scanImage)
+
+    # Mark files and log. Cards still queued for the writer are checked for on
+    # the next run, a crash before they land redoes this scan.
+    key = state["pending"].pop(baseName, None)
+    if key is None:
+        key = {"hash": fileHash(result["inputPath"]), "params": state["params"], "stamp": None}
+    state["scans"][baseName] = dict(key, cards=names, written=writeCards)
+    cardStore.saveScan(
+        side,
+        baseName,
+        state["scans"][baseName],
+        [(name, card["x"], card["y"], card["box"]) for name, card in zip(names, result["cards"])],
+        state["index"],
+    )
+    print(f"[DONE] {baseName} in {result['timing']:.2}s")
+
+
+def initWorker(writerSettings, debugSettings, detectorSettings, metricsSettings):
+    # one OpenCV thread per process, the pool does the fanning out
+    cv2.setNumThreads(1)
+    configure(**detectorSettings)
+    metrics.configure(**metricsSettings)
+    imageWriter.configure(**writerSettings)
+    debugOutput.configure(**debugSettings)
+    # pool workers skip atexit, finish the queued debug images on shutdown instead
+    Finalize(None, imageWriter.flush, exitpriority=10)
+
+
+def runScanner(side, workers=1):
+    state = loadState(side)
+    totalStart = time.time()
+
+    # Skip scans already processed with the same file and settings
+    pending = [inputPath for inputPath in listScans(side) if needsScan(state, inputPath)]
+
+    worker = partial(processScan, side=side)
+    if workers > 1 and len(pending) > 1:
+        print(f"[INFO] Detecting {len(pending)} {side} scans on {workers} workers")
+        pool = Pool(
+            workers,
+            initializer=initWorker,
+            initargs=(imageWriter.settings(), debugOutput.settings(), settings(), metrics.settings()),
+        )
+        # imap yields in scan order, so numbering matches a serial run
+        for result in pool.imap(worker, pending, chunksize=1):
+            commitScan(state, result)
+        pool.close()
+        pool.join()
+    else:
+        for inputPath in pending:
+            commitScan(state, worker(inputPath))
+
+    imageWriter.flush()
+    saveState(state)
+    debugOutput.report()
+    metrics.report()
+    print(f"\n[COMPLETE] All {side} scans processed in {time.time() - totalStart:.2f}s")
+    return state
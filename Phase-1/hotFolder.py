@@ -0,0 +1,124 @@
+import os
+import time
+
+# ======= HOT FOLDER ======= #
+# Finds the scans that have landed in _INPUT since the last look, for
+# `scan-master.py --watch`. The folder is only listed again when its mtime
+# moves (a file was created, renamed or deleted) or every `relist` seconds,
+# and only files that have not been handed out yet are stat'ed, so a poll
+# costs about the same with 50 or 50 000 scans in the folder. A file is handed
+# out once it has not been written to for `settle` seconds and, for PNGs,
+# once it ends in the IEND chunk, so a scanner or a copy still writing it is
+# never read half way. A rescan saved over a scan that was already handed out
+# is offered again: a file replaced by rename shows a new inode in the next
+# listing, one overwritten in place a new size/mtime on the `relist` pass.
+
+pollInterval = 0.5  # s between looks at the folder
+settle = 1.0  # s a file must go unwritten before it is read
+relist = 10.0  # s, list the folder even if its mtime says nothing changed
+pngTrailer = b"IEND\xaeB`\x82"
+
+
+def settings():
+    return {"pollInterval": pollInterval, "settle": settle}
+
+
+def configure(**kwargs):
+    global pollInterval, settle
+    pollInterval = kwargs.get("pollInterval") or pollInterval
+    settle = kwargs["settle"] if kwargs.get("settle") is not None else settle
+
+
+def addArguments(parser):
+    parser.add_argument("--poll", type=float, default=None, help=f"seconds between looks at _INPUT (default: {pollInterval})")
+    parser.add_argument("--settle", type=float, default=None, help=f"seconds a scan must go unwritten before it is read (default: {settle})")
+
+
+def configureFromArgs(args):
+    configure(pollInterval=args.poll, settle=args.settle)
+
+
+def isScan(name):
+    lower = name.lower()
+    return lower.endswith(".png") and ("front" in lower or "back" in lower)
+
+
+def finished(path):
+    # a PNG is only complete once its IEND chunk is written
+    if not path.lower().endswith(".png"):
+        return True
+    try:
+        with open(path, "rb") as f:
+            f.seek(-len(pngTrailer), os.SEEK_END)
+            return f.read() == pngTrailer
+    except OSError:
+        return False
+
+
+def newWatch(directory):
+    return {
+        "dir": directory,
+        "dirStamp": None,
+        "listed": 0.0,
+        "handedOut": {},  # name -> (inode, size, mtime) when poll() returned it
+        "waiting": {},  # name -> {"path", "stamp", "since"}, seen but not settled yet
+    }
+
+
+def changed(entry, handed, full):
+    # Has a handed out file been replaced since? The inode comes with the
+    # listing for free, size and mtime cost a stat and are only checked on a
+    # `full` pass.
+    try:
+        if entry.inode() != handed[0]:
+            return True
+        if full:
+            stat = entry.stat()
+            return (stat.st_size, stat.st_mtime_ns) != handed[1:]
+    except FileNotFoundError:
+        pass
+    return False
+
+
+def poll(watch, now=None):
+    # -> [(path, landed)] for every scan that is done being written, landed
+    # being the time of its last write. A name is handed out again only once
+    # the file has changed.
+    now = now or time.time()
+    try:
+        dirStamp = os.stat(watch["dir"]).st_mtime_ns
+    except FileNotFoundError:
+        return []
+    full = now - watch["listed"] >= relist
+    if dirStamp != watch["dirStamp"] or full:
+        watch["dirStamp"], watch["listed"] = dirStamp, now
+        handedOut, waiting = watch["handedOut"], watch["waiting"]
+        with os.scandir(watch["dir"]) as entries:
+            for entry in entries:
+                name = entry.name
+                if name in waiting or not isScan(name):
+                    continue
+                if name in handedOut:
+                    if not changed(entry, handedOut[name], full):
+                        continue
+                    del handedOut[name]
+                waiting[name] = {"path": entry.path, "stamp": None, "since": now}
+
+    ready = []
+    for name, waiting in list(watch["waiting"].items()):
+        try:
+            stat = os.stat(waiting["path"])
+        except FileNotFoundError:
+            # moved away again before it was done
+            del watch["waiting"][name]
+            continue
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        if stamp != waiting["stamp"]:
+            # an mtime in the past counts as settled already, one from a
+            # skewed clock in the future only once it has held still
+            waiting["stamp"], waiting["since"] = stamp, min(now, stat.st_mtime_ns / 1e9)
+        if stat.st_size and now - waiting["since"] >= settle and finished(waiting["path"]):
+            del watch["waiting"][name]
+            watch["handedOut"][name] = (stat.st_ino, *stamp)
+            ready.append((waiting["path"], waiting["since"]))
+    return ready
@@ -0,0 +1,145 @@
+import atexit
+import cv2
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# ======= BACKGROUND IMAGE WRITER ======= #
+# Every stage hands its cv2.imwrite calls to one shared thread pool, so PNG
+# compression overlaps with the next scan's compute (OpenCV drops the GIL while
+# encoding). At most `maxPending` images can be queued: write() blocks once the
+# queue is full, which keeps memory bounded when encoding can't keep up.
+# Debug output can use a cheaper format than the real output.
+
+threads = max(2, (os.cpu_count() or 2) // 2)
+maxPending = 16
+pngLevel = 1  # 0-9, 1 is fast and still much smaller than raw
+debugFormat = "png"  # png / webp / jpg, only for debug images
+debugQuality = 80  # webp/jpg quality for debug images
+
+lock = threading.Lock()
+pool = None
+slots = None
+pending = {}  # path -> future
+
+
+def settings():
+    return {
+        "threads": threads,
+        "maxPending": maxPending,
+        "pngLevel": pngLevel,
+        "debugFormat": debugFormat,
+        "debugQuality": debugQuality,
+    }
+
+
+def configure(**kwargs):
+    # must run before the first write(), the pool is sized on first use
+    global threads, maxPending, pngLevel, debugFormat, debugQuality
+    threads = kwargs.get("threads") or threads
+    maxPending = kwargs.get("maxPending") or maxPending
+    pngLevel = kwargs["pngLevel"] if kwargs.get("pngLevel") is not None else pngLevel
+    debugFormat = kwargs.get("debugFormat") or debugFormat
+    debugQuality = kwargs.get("debugQuality") or debugQuality
+
+
+def addArguments(parser):
+    parser.add_argument(
+        "--png-level", type=int, default=None, help=f"PNG compression 0-9 (default: {pngLevel})"
+    )
+    parser.add_argument(
+        "--debug-format",
+        choices=["png", "webp", "jpg"],
+        default=None,
+        help="image format for debug output (default: png)",
+    )
+    parser.add_argument("--writer-threads", type=int, default=None, help="background image writer threads")
+
+
+def configureFromArgs(args):
+    configure(pngLevel=args.png_level, debugFormat=args.debug_format, threads=args.writer_threads)
+
+
+def getPool():
+    global pool, slots
+    with lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="imageWriter")
+            slots = threading.BoundedSemaphore(maxPending)
+        return pool
+
+
+def encodeParams(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".png":
+        return [cv2.IMWRITE_PNG_COMPRESSION, pngLevel]
+    if ext == ".webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, debugQuality]
+    if ext in (".jpg", ".jpeg"):
+        return [cv2.IMWRITE_JPEG_QUALITY, debugQuality]
+    return []
+
+
+def debugPath(path):
+    # swap the extension of a debug image for the configured debug format
+    if debugFormat == "png":
+        return path
+    return os.path.splitext(path)[0] + "." + debugFormat
+
+
+def writeImage(path, image):
+    # encode and write are timed apart, PNG compression is usually the cost
+    item = os.path.basename(path)
+    try:
+        with metrics.span("encode", item):
+            ok, encoded = cv2.imencode(os.path.splitext(path)[1], image, encodeParams(path))
+        if not ok:
+            print(f"[ERROR] Could not write {path}")
+            return
+        try:
+            with metrics.span("write", item), open(path, "wb") as f:
+                f.write(encoded.data)
+        except OSError as e:
+            print(f"[ERROR] Could not write {path}: {e}")
+            return
+        metrics.count("bytesWritten", encoded.nbytes)
+    finally:
+        slots.release()
+
+
+def write(path, image, debug=False):
+    # The caller must not modify `image` afterwards, it is encoded later.
+    if debug:
+        path = debugPath(path)
+    executor = getPool()
+    slots.acquire()  # back-pressure
+    future = executor.submit(writeImage, path, image)
+    with lock:
+        pending[path] = future
+    future.add_done_callback(lambda f, path=path: forget(path, f))
+    return future
+
+
+def forget(path, future):
+    with lock:
+        if pending.get(path) is future:
+            del pending[path]
+
+
+def waitFor(path):
+    with lock:
+        future = pending.get(path)
+    if future is not None:
+        future.result()
+
+
+def flush():
+    with lock:
+        futures = list(pending.values())
+    for future in futures:
+        future.result()
+
+
+atexit.register(flush)
@@ -0,0 +1,197 @@
+import csv
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+# ======= RUN METRICS ======= #
+# One instrumentation layer shared by every stage. span(stage) times a block
+# and records it against the scan (or card) the current thread is working on,
+# set with scope(). count() adds up bytes read and written. Everything stays in
+# memory until report(), which prints p50/p95 per stage and, if asked for,
+# writes the spans as a JSON or CSV trace and the totals as a Prometheus
+# textfile. Pool workers hand their spans back with each scan result
+# (drain() there, merge() in the parent).
+
+trace = None  # path of a .json or .csv span trace
+promFile = None  # path of a Prometheus textfile (node_exporter textfile collector)
+live = False  # print every span as it ends
+
+lock = threading.Lock()
+current = threading.local()
+spans = []
+counters = defaultdict(int)
+
+
+def settings():
+    return {"trace": trace, "promFile": promFile, "live": live}
+
+
+def configure(**kwargs):
+    global trace, promFile, live
+    trace = kwargs.get("trace") or trace
+    promFile = kwargs.get("promFile") or promFile
+    live = kwargs.get("live", live)
+
+
+def addArguments(parser):
+    parser.add_argument("--trace", default=None, help="write every timed span to this .json or .csv file")
+    parser.add_argument("--metrics-file", default=None, help="write per-stage totals as a Prometheus textfile")
+    parser.add_argument("--time-debug", action="store_true", help="print each stage's time as it finishes")
+
+
+def configureFromArgs(args):
+    configure(trace=args.trace, promFile=args.metrics_file, live=args.time_debug)
+
+
+# === RECORDING ===
+@contextmanager
+def scope(item):
+    # spans recorded on this thread inside the block belong to `item`
+    previous = getattr(current, "item", None)
+    current.item = item
+    try:
+        yield
+    finally:
+        current.item = previous
+
+
+def currentItem():
+    return getattr(current, "item", None)
+
+
+@contextmanager
+def span(stage, item=None):
+    wall = time.time()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - start, item or currentItem(), wall)
+
+
+def record(stage, seconds, item=None, start=None):
+    entry = {
+        "stage": stage,
+        "item": item,
+        "start": start if start is not None else time.time() - seconds,
+        "seconds": seconds,
+        "pid": os.getpid(),
+        "thread": threading.current_thread().name,
+    }
+    with lock:
+        spans.append(entry)
+    if live:
+        print(f"[TIME] {item + ' ' if item else ''}{stage} took: {seconds:.4f}s")
+
+
+def count(name, amount=1):
+    with lock:
+        counters[name] += amount
+
+
+def imread(path, flags=cv2.IMREAD_COLOR):
+    # cv2.imread, counted as a decode span and as bytes read
+    with span("decode"):
+        image = cv2.imread(path, flags)
+    if image is not None:
+        count("bytesRead", os.path.getsize(path))
+    return image
+
+
+def drain():
+    # take everything recorded in this process so far (pool workers)
+    global spans, counters
+    with lock:
+        taken = {"spans": spans, "counters": dict(counters)}
+        spans, counters = [], defaultdict(int)
+    return taken
+
+
+def merge(taken):
+    if not taken:
+        return
+    with lock:
+        spans.extend(taken["spans"])
+        for name, amount in taken["counters"].items():
+            counters[name] += amount
+
+
+# === REPORTING ===
+def summary():
+    # stage -> count, total, p50, p95 and max seconds, in first-seen order
+    byStage = defaultdict(list)
+    with lock:
+        for entry in spans:
+            byStage[entry["stage"]].append(entry["seconds"])
+    stats = {}
+    for stage, values in byStage.items():
+        values = np.array(values)
+        stats[stage] = {
+            "count": len(values),
+            "total": float(values.sum()),
+            "p50": float(np.percentile(values, 50)),
+            "p95": float(np.percentile(values, 95)),
+            "max": float(values.max()),
+        }
+    return stats
+
+
+def writeTrace(path):
+    with lock:
+        rows, totals = list(spans), dict(counters)
+    tmpPath = f"{path}.tmp"
+    with open(tmpPath, "w", newline="") as f:
+        if path.lower().endswith(".csv"):
+            writer = csv.DictWriter(f, fieldnames=["stage", "item", "start", "seconds", "pid", "thread"])
+            writer.writeheader()
+            writer.writerows(rows)
+        else:
+            json.dump({"spans": rows, "counters": totals}, f, indent=1)
+    os.replace(tmpPath, path)
+
+
+def writePrometheus(path, stats):
+    lines = [
+        "# HELP postcard_stage_seconds Time spent in each pipeline stage.",
+        "# TYPE postcard_stage_seconds summary",
+    ]
+    for stage, s in stats.items():
+        lines.append(f'postcard_stage_seconds{{stage="{stage}",quantile="0.5"}} {s["p50"]:.6f}')
+        lines.append(f'postcard_stage_seconds{{stage="{stage}",quantile="0.95"}} {s["p95"]:.6f}')
+        lines.append(f'postcard_stage_seconds_sum{{stage="{stage}"}} {s["total"]:.6f}')
+        lines.append(f'postcard_stage_seconds_count{{stage="{stage}"}} {s["count"]}')
+    lines += ["# HELP postcard_bytes_total Bytes read and written by the pipeline.", "# TYPE postcard_bytes_total counter"]
+    for name in ("bytesRead", "bytesWritten", "bytesSent"):
+        lines.append(f'postcard_bytes_total{{kind="{name}"}} {counters.get(name, 0)}')
+    lines.append(f"postcard_last_run_timestamp_seconds {time.time():.0f}")
+    # the textfile collector may read at any moment, never show it half a file
+    tmpPath = f"{path}.tmp"
+    with open(tmpPath, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmpPath, path)
+
+
+def report():
+    stats = summary()
+    if stats:
+        print(f"\n[TIME] {'stage':<12}{'count':>7}{'total':>10}{'p50':>10}{'p95':>10}{'max':>10}")
+        for stage, s in sorted(stats.items(), key=lambda kv: -kv[1]["total"]):
+            print(
+                f"[TIME] {stage:<12}{s['count']:>7}{s['total']:>9.2f}s"
+                f"{1000 * s['p50']:>8.1f}ms{1000 * s['p95']:>8.1f}ms{1000 * s['max']:>8.1f}ms"
+            )
+    if counters:
+        print("[TIME] " + ", ".join(f"{name} {amount / 1e6:.1f} MB" for name, amount in sorted(counters.items())))
+    if trace:
+        writeTrace(trace)
+        print(f"[INFO] Trace written to {trace}")
+    if promFile:
+        writePrometheus(promFile, stats)
+        print(f"[INFO] Metrics written to {promFile}")
+    return stats
@@ -0,0 +1,197 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import pytesseract
+
+import cardStore
+import metrics
+
+# ======= CARD ORIENTATION ======= #
+# Works out how far each card has to be turned (clockwise, 0/90/180/270) so
+# its text reads upright. Cards are shrunk to `analysisSize` first and looked
+# at with a cheap text line heuristic: in Latin print and handwriting more ink
+# sits above a line's x-height band (capitals, ascenders) than below it
+# (descenders), so the side with the ink is the top. Only when that is unsure
+# is tesseract's OSD asked, on a slightly larger copy. Decided turns are kept
+# in cardStore by a hash of the shrunk card, so such a card is only looked at
+# once. Cards nobody was sure about are not kept, they get another look on
+# the next run (with tesseract installed, or other settings). A batch is
+# spread over `workers` threads: the OpenCV calls drop the GIL and OSD runs in
+# its own tesseract process anyway.
+
+enabled = True
+useOSD = True
+workers = 4
+analysisSize = 800  # px, longest side the heuristic looks at
+osdSize = 1600  # px, longest side handed to OSD
+minConfidence = 0.25  # heuristic confidence below which OSD decides, or the card stays as it is
+minLines = 3  # fewer text lines than this and the heuristic is unsure
+osdMinConfidence = 1.5  # tesseract's "Orientation confidence" needed to turn a card
+
+lock = threading.Lock()
+pool = None
+osdReady = None  # is tesseract installed, None until first asked
+
+
+def settings():
+    return {"enabled": enabled, "useOSD": useOSD, "workers": workers}
+
+
+def configure(**kwargs):
+    global enabled, useOSD, workers
+    enabled = kwargs.get("enabled", enabled)
+    useOSD = kwargs.get("useOSD", useOSD)
+    workers = kwargs.get("workers") or workers
+
+
+def addArguments(parser):
+    parser.add_argument("--no-orient", action="store_true", help="put cards on the page as cropped, without turning them upright")
+    parser.add_argument("--no-osd", action="store_true", help="only use the text line heuristic, never tesseract OSD")
+    parser.add_argument("--orient-workers", type=int, default=None, help=f"threads for orientation (default: {workers})")
+
+
+def configureFromArgs(args):
+    configure(enabled=not args.no_orient, useOSD=not args.no_osd, workers=args.orient_workers)
+
+
+def shrink(image, size):
+    scale = size / max(image.shape[:2])
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+
+# === HEURISTIC ===
+def lineScores(ink):
+    # (score, weight) per text line in a binary ink image, lines running
+    # horizontally. score > 0: more ink above the x-height band than below.
+    h, w = ink.shape
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(ink, connectivity=8)
+    # keep character sized blobs, drop specks, borders and pictures
+    widths, heights = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    keep = (heights >= 4) & (heights <= 0.1 * h) & (widths <= 0.25 * w) & (stats[:, cv2.CC_STAT_AREA] >= 6)
+    keep[0] = False
+    chars = (keep[labels] * 255).astype(np.uint8)
+
+    # smear characters sideways into one blob per line
+    smear = cv2.dilate(chars, cv2.getStructuringElement(cv2.MORPH_RECT, (max(9, w // 50), 1)))
+    count, _, lines, _ = cv2.connectedComponentsWithStats(smear, connectivity=8)
+    scores = []
+    for x, y, lw, lh, _ in lines[1:]:
+        if lw < 4 * lh or lh < 6:
+            continue
+        profile = chars[y : y + lh, x : x + lw].sum(axis=1, dtype=np.float64)
+        core = np.flatnonzero(profile >= 0.5 * profile.max())
+        above, below = profile[: core[0]].sum(), profile[core[-1] + 1 :].sum()
+        if above + below < 0.05 * profile.sum():
+            continue
+        scores.append(((above - below) / (above + below), lw))
+    return scores
+
+
+def estimate(gray):
+    # -> (rotate, confidence) from the text line heuristic, confidence 0..1
+    ink = cv2.adaptiveThreshold(gray, 255, cv2.ADAPTIVE_THRESH_MEAN_C, cv2.THRESH_BINARY_INV, 31, 15)
+    candidates = []
+    # lines running across the card: upright or upside down. Lines running
+    # down it: the card is on its side, look at it turned clockwise.
+    for turn, flipped in ((0, 180), (90, 270)):
+        view = ink if turn == 0 else cv2.rotate(ink, cv2.ROTATE_90_CLOCKWISE)
+        scores = lineScores(view)
+        weight = sum(w for _, w in scores)
+        if weight:
+            score = sum(s * w for s, w in scores) / weight
+            candidates.append((weight, len(scores), turn if score > 0 else flipped, abs(score), view.shape[1]))
+    if not candidates:
+        return 0, 0.0
+
+    weight, lines, rotate, score, width = max(candidates)
+    # a few short lines say little, however lopsided they are: want
+    # `minLines` lines and at least a card's width of text between them
+    confidence = score * min(1.0, lines / minLines, weight / width)
+    return rotate, confidence
+
+
+# === OSD FALLBACK ===
+def osdAvailable():
+    # checked once, so a missing binary doesn't cost a failed call per card
+    global osdReady
+    with lock:
+        if osdReady is None:
+            try:
+                pytesseract.get_tesseract_version()
+                osdReady = True
+            except pytesseract.TesseractNotFoundError:
+                osdReady = False
+                print("[WARN] tesseract is not installed, cards are oriented by the text line heuristic only")
+        return osdReady
+
+
+def osd(image):
+    # -> (rotate, confidence) from tesseract, or None if it can't tell
+    if not osdAvailable():
+        return None
+    try:
+        with metrics.span("osd"):
+            text = pytesseract.image_to_osd(image)
+    except pytesseract.TesseractError as e:
+        print(f"[WARN] OSD failed: {e}")
+        return None
+    fields = dict(line.split(":", 1) for line in text.splitlines() if ":" in line)
+    rotate = int(fields.get("Rotate", "0").strip())
+    confidence = float(fields.get("Orientation confidence", "0").strip())
+    if confidence < osdMinConfidence:
+        return None
+    return rotate, confidence
+
+
+def orientOne(image, small):
+    # -> (rotate, confidence, method) for one card, `small` is it shrunk to analysisSize
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+    rotate, confidence = estimate(gray)
+    if confidence >= minConfidence:
+        return rotate, confidence, "lines"
+    found = osd(shrink(image, osdSize)) if useOSD else None
+    if found is not None:
+        return found[0], found[1], "osd"
+    # neither is sure, a card left as cropped beats one turned on a guess
+    return 0, confidence, "none"
+
+
+def cardHash(small):
+    # a hash of the shrunk card is enough to recognise it, and cheap
+    return hashlib.sha1(small.tobytes() + str(small.shape).encode()).hexdigest()
+
+
+def getPool():
+    global pool
+    with lock:
+        if pool is None:
+            pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="orient")
+        return pool
+
+
+def orient(images):
+    # clockwise turn for each image, from the cache where possible
+    if not enabled or not images:
+        return [0] * len(images)
+    smalls = list(getPool().map(lambda image: shrink(image, analysisSize), images))
+    hashes = [cardHash(small) for small in smalls]
+    known = cardStore.loadOrientations(hashes)
+    todo = [i for i, h in enumerate(hashes) if h not in known]
+    if todo:
+        item = metrics.currentItem()
+
+        def run(i):
+            # OSD spans still belong to the scan being combined
+            with metrics.scope(item):
+                return orientOne(images[i], smalls[i])
+
+        found = list(getPool().map(run, todo))
+        cardStore.saveOrientations([(hashes[i], *result) for i, result in zip(todo, found) if result[2] != "none"])
+        for i, (rotate, _, _) in zip(todo, found):
+            known[hashes[i]] = rotate
+    return [known[h] for h in hashes]
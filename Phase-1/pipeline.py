@@ -0,0 +1,468 @@
+import os
+import queue
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import numpy as np
+
+import cardCache
+import combiner
+import debugOutput
+import detector
+import hotFolder
+import imageWriter
+import metrics
+
+# ======= IN-PROCESS PIPELINE ======= #
+# Runs every stage as a function call inside one interpreter, so OpenCV is only
+# imported once. The work is laid out as a DAG of per-scan nodes:
+#
+#   detect:front:scN ─> commit:front:scN ─┐
+#                                         ├─> combine:scN ─> analyze:scN
+#   detect:back:scN  ─> commit:back:scN  ─┘
+#
+# commit nodes chain onto the previous scan of the same side (that is where the
+# cardNNNN numbers get handed out), everything else runs as soon as its inputs
+# are ready. There is no global barrier between detection and combining: scans
+# are detected in scan number order with both sides together, at most `workers`
+# detections are open at a time (started but not committed yet, each holding a
+# full scan and its cards), and ready commit/combine steps go ahead of new
+# detections. So sc01 is combined while later scans are still being detected
+# and peak memory depends on the thread count, not on the batch size.
+
+
+def runDag(nodes, workers):
+    # nodes = {name: (fn, [deps])}, fn gets the results of its deps in order.
+    # Nodes without deps are sources, started in dict order and only while
+    # fewer than `workers` of them have dependents still to run.
+    results = {}
+    failed = set()
+    waitingOn = {name: set(deps) for name, (fn, deps) in nodes.items()}
+    dependents = defaultdict(list)
+    for name, (fn, deps) in nodes.items():
+        for dep in deps:
+            dependents[dep].append(name)
+    sources = deque(name for name, (fn, deps) in nodes.items() if not deps)
+    openSources = {}  # source -> dependents not finished yet
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+
+        def submit(name):
+            fn, deps = nodes[name]
+            running[pool.submit(fn, *[results[d] for d in deps])] = name
+
+        def submitReady():
+            # finish what has been started before starting anything new
+            for name in [n for n, deps in waitingOn.items() if not deps and nodes[n][1]]:
+                del waitingOn[name]
+                submit(name)
+            while sources and len(openSources) < workers:
+                name = sources.popleft()
+                if name not in waitingOn:
+                    continue  # dropped
+                del waitingOn[name]
+                openSources[name] = sum(child in waitingOn for child in dependents[name])
+                submit(name)
+
+        def finished(name):
+            # `name` has run or was dropped, its sources are needed once less
+            for dep in nodes[name][1]:
+                if dep in openSources:
+                    openSources[dep] -= 1
+                    if not openSources[dep]:
+                        del openSources[dep]
+            if openSources.get(name) == 0:
+                del openSources[name]
+
+        def dropDependents(name):
+            for child in dependents[name]:
+                if child in waitingOn:
+                    del waitingOn[child]
+                    failed.add(child)
+                    print(f"[SKIP] {child} (depends on {name})")
+                    finished(child)
+                    dropDependents(child)
+
+        submitReady()
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                except Exception as e:
+                    print(f"[ERROR] {name} failed: {e}")
+                    failed.add(name)
+                    finished(name)
+                    dropDependents(name)
+                    continue
+                finished(name)
+                for child in dependents[name]:
+                    if child in waitingOn:
+                        waitingOn[child].discard(name)
+            submitReady()
+
+    return results, failed
+
+
+def scanPrefix(baseName):
+    return baseName.rsplit("-", 1)[0]
+
+
+def pendingScans(states):
+    pending = {}
+    for side, state in states.items():
+        pending[side] = []
+        for inputPath in detector.listScans(side):
+            if not detector.needsScan(state, inputPath):
+                continue
+            baseName = os.path.splitext(os.path.basename(inputPath))[0]
+            pending[side].append((baseName, inputPath))
+    return pending
+
+
+def buildNodes(states, analyze=False, writeCards=True):
+    nodes = {}
+    lastCommit = {}
+    commitNodes = defaultdict(list)
+
+    # both sides of a scan next to each other, so runDag detects them together
+    pending = [
+        (side, baseName, inputPath)
+        for side, scans in pendingScans(states).items()
+        for baseName, inputPath in scans
+    ]
+    pending.sort(key=lambda scan: combiner.scanNumber(scanPrefix(scan[1])))
+    for side, baseName, inputPath in pending:
+        state = states[side]
+        detectName = f"detect:{side}:{baseName}"
+        commitName = f"commit:{side}:{baseName}"
+        nodes[detectName] = (
+            lambda path=inputPath, side=side: detector.processScan(path, side, keepImages=True),
+            [],
+        )
+        deps = [detectName] + ([lastCommit[side]] if lastCommit.get(side) else [])
+        nodes[commitName] = (
+            lambda result, *prev, state=state: detector.commitScan(state, result, writeCards),
+            deps,
+        )
+        lastCommit[side] = commitName
+        commitNodes[scanPrefix(baseName)].append(commitName)
+
+    # every scan with both sides known (already on disk or detected this run)
+    prefixes = {scanPrefix(k) for k in states["front"]["contourCoords"]}
+    prefixes |= {p for p, commits in commitNodes.items() if any(":front:" in c for c in commits)}
+    unwritten = 0
+    for prefix in sorted(prefixes, key=combiner.scanNumber):
+        frontKey, backKey = f"{prefix}-front", f"{prefix}-back"
+        hasBack = backKey in states["back"]["contourCoords"] or any(
+            ":back:" in c for c in commitNodes[prefix]
+        )
+        if not hasBack:
+            print(f"[WARN] No matching back scan for {frontKey}")
+            continue
+        stored = [states["front"]["scans"].get(frontKey, {}), states["back"]["scans"].get(backKey, {})]
+        if not commitNodes[prefix] and not all(entry.get("written", True) for entry in stored):
+            # combined by a --no-card-files run from memory, its card PNGs
+            # were never written and there is nothing to recombine from
+            unwritten += 1
+            continue
+
+        combineName = f"combine:{prefix}"
+        nodes[combineName] = (
+            lambda *commits, prefix=prefix, frontKey=frontKey, backKey=backKey: combiner.combineScan(
+                prefix,
+                states["front"]["contourCoords"].get(frontKey, {}),
+                states["back"]["contourCoords"].get(backKey, {}),
+            ),
+            commitNodes[prefix],
+        )
+
+        if analyze and commitNodes[prefix]:
+            # scans from earlier runs are recombined, but only analysed once
+            nodes[f"analyze:{prefix}"] = (
+                lambda result: analyzeCombined(result, analyze),
+                [combineName],
+            )
+
+    if unwritten:
+        print(f"[SKIP] {unwritten} scans combined earlier without card files, not recombined")
+    return nodes
+
+
+def analyzeCombined(result, mode="composite"):
+    # card-analysis lives one level up and pulls in ollama, only load it on demand
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import cardAnalysis
+
+    if mode == "pairs":
+        # one request per matched pair, with the two cropped cards
+        pairs = [
+            (
+                front,
+                os.path.join(combiner.frontImageDir, f"{front}_front.png"),
+                os.path.join(combiner.backImageDir, f"{back}_back.png"),
+            )
+            for front, back in result["matches"]
+        ]
+        for _, frontPath, backPath in pairs:
+            imageWriter.waitFor(frontPath)
+            imageWriter.waitFor(backPath)
+        cardAnalysis.analyzePairs(pairs)
+        return
+
+    for path in result["composites"]:
+        imageWriter.waitFor(path)
+    cardAnalysis.analyzeImages(result["composites"])
+
+
+def runPipeline(workers=None, analyze=False, writeCards=True):
+    totalStart = time.time()
+    workers = workers or os.cpu_count()
+
+    states = {side: detector.loadState(side) for side in ("front", "back")}
+    combiner.setupDirs()
+
+    nodes = buildNodes(states, analyze=analyze, writeCards=writeCards)
+    print(f"[INFO] Running {len(nodes)} pipeline steps on {workers} threads")
+    results, failed = runDag(nodes, workers)
+    cardCache.flush()
+
+    for state in states.values():
+        detector.saveState(state)
+
+    combineResults = [r for name, r in results.items() if name.startswith("combine:")]
+    combiner.finishReport(combineResults)
+    debugOutput.report()
+    metrics.report()
+
+    if failed:
+        print(f"[WARN] {len(failed)} steps failed or were skipped")
+    print(f"\n[COMPLETE] Pipeline finished in {time.time() - totalStart:.2f}s")
+    return results
+
+
+# ======= STREAMING MODE ======= #
+# Detection results land on a bounded queue and a single combine worker pairs
+# them up. A scan is committed (numbered) and combined the moment both of its
+# sides are out of detection, so the first composite appears after one scan
+# rather than after the whole batch. At most `queueDepth` scans are in flight
+# at any time, which keeps memory flat no matter how big _INPUT is.
+
+
+def runStreaming(workers=None, queueDepth=4, analyze=False, writeCards=True):
+    totalStart = time.time()
+    workers = workers or os.cpu_count()
+
+    states = {side: detector.loadState(side) for side in ("front", "back")}
+    combiner.setupDirs()
+
+    # scan order per side is the commit order, prefixes pair the two sides
+    pending = pendingScans(states)
+    commitOrder = {side: [b for b, _ in scans] for side, scans in pending.items()}
+    bySide = defaultdict(dict)
+    for side, scans in pending.items():
+        for baseName, inputPath in scans:
+            bySide[scanPrefix(baseName)][side] = (baseName, inputPath)
+    prefixes = sorted(bySide, key=combiner.scanNumber)
+    expected = sum(len(scans) for scans in pending.values())
+
+    resultQueue = queue.Queue(maxsize=2 * queueDepth)
+    slots = threading.BoundedSemaphore(queueDepth)
+    print(f"[INFO] Streaming {len(prefixes)} scans on {workers} threads (queue depth {queueDepth})")
+
+    def detectInto(prefix, side, inputPath):
+        try:
+            result = detector.processScan(inputPath, side, keepImages=True)
+        except Exception as e:
+            baseName = os.path.splitext(os.path.basename(inputPath))[0]
+            result = {"inputPath": inputPath, "baseName": baseName, "cards": [], "error": str(e)}
+        resultQueue.put((prefix, side, result))
+
+    def feed(pool):
+        for prefix in prefixes:
+            slots.acquire()  # released once the scan has been combined
+            for side, (baseName, inputPath) in bySide[prefix].items():
+                pool.submit(detectInto, prefix, side, inputPath)
+
+    ready = {side: {} for side in pending}
+    committed = defaultdict(set)
+    combineResults = []
+    latencies = []
+    scanStart = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=1) as analysisPool:
+        feeder = threading.Thread(target=feed, args=(pool,), daemon=True)
+        feeder.start()
+
+        for _ in range(expected):
+            prefix, side, result = resultQueue.get()
+            scanStart.setdefault(prefix, time.time() - result.get("timing", 0))
+            ready[side][result["baseName"]] = result
+
+            # commit in scan order, that is where cardNNNN gets handed out
+            order = commitOrder[side]
+            while order and order[0] in ready[side]:
+                baseName = order.pop(0)
+                detector.commitScan(states[side], ready[side].pop(baseName), writeCards)
+                committed[scanPrefix(baseName)].add(side)
+
+            for donePrefix in [p for p in list(committed) if committed[p] == set(bySide[p])]:
+                del committed[donePrefix]
+                frontKey, backKey = f"{donePrefix}-front", f"{donePrefix}-back"
+                frontCards = states["front"]["contourCoords"].get(frontKey)
+                backCards = states["back"]["contourCoords"].get(backKey)
+                if frontCards is None or backCards is None:
+                    print(f"[WARN] No matching {'back' if frontCards is not None else 'front'} scan for {donePrefix}")
+                else:
+                    combined = combiner.combineScan(donePrefix, frontCards, backCards)
+                    combineResults.append(combined)
+                    if analyze:
+                        analysisPool.submit(analyzeCombined, combined, analyze)
+                latencies.append(time.time() - scanStart.pop(donePrefix))
+                slots.release()
+
+        feeder.join()
+    cardCache.flush()
+
+    for state in states.values():
+        detector.saveState(state)
+    combiner.finishReport(combineResults)
+    debugOutput.report()
+    metrics.report()
+
+    if latencies:
+        print(
+            f"[INFO] Per-scan latency: first {min(latencies):.2f}s, "
+            f"median {np.percentile(latencies, 50):.2f}s, max {max(latencies):.2f}s"
+        )
+    print(f"\n[COMPLETE] Streaming pipeline finished in {time.time() - totalStart:.2f}s")
+    return combineResults
+
+
+# ======= WATCH MODE ======= #
+# A long running process fed by hotFolder: OpenCV, the writer and orientation
+# pools, cardCache and (with analyze) the loaded model all stay warm between
+# scans. Every file is detected as soon as it is done being written, commits
+# keep arrival order per side, and a scan is combined the moment both of its
+# sides are committed, even if the other side was cropped by an earlier run.
+# Latency runs from the last write of a scan's later file to its composites
+# being queued. Every `reportEvery` combined scans the stage table and the
+# latencies are printed and start over, so a daemon's memory stays flat.
+
+
+def runWatch(workers=None, analyze=False, writeCards=True, reportEvery=50):
+    workers = workers or os.cpu_count()
+
+    states = {side: detector.loadState(side) for side in ("front", "back")}
+    combiner.setupDirs()
+    if analyze:
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        import cardAnalysis
+
+        if cardAnalysis.keepAlive is None:
+            cardAnalysis.keepAlive = -1  # scans come in bursts, don't let ollama unload the model in between
+        cardAnalysis.warmUp()
+
+    watch = hotFolder.newWatch(detector.inputDir)
+    resultQueue = queue.Queue()
+    inFlight = {side: deque() for side in states}  # base names in commit order
+    ready = {side: {} for side in states}
+    landed = {}  # prefix -> when its latest file was last written
+    latencies = []
+    combineResults = []
+    stopping = False
+    print(
+        f"[INFO] Watching {detector.inputDir} on {workers} threads "
+        f"(poll {hotFolder.pollInterval}s, settle {hotFolder.settle}s), Ctrl+C to stop"
+    )
+
+    def detectInto(side, inputPath):
+        try:
+            result = detector.processScan(inputPath, side, keepImages=True)
+        except Exception as e:
+            baseName = os.path.splitext(os.path.basename(inputPath))[0]
+            result = {"inputPath": inputPath, "baseName": baseName, "cards": [], "error": str(e)}
+        resultQueue.put((side, result))
+
+    def report():
+        combiner.finishReport(combineResults)
+        metrics.report()
+        metrics.drain()
+        if latencies:
+            print(
+                f"[INFO] Per-scan latency over {len(latencies)} scans: median {np.percentile(latencies, 50):.2f}s, "
+                f"p95 {np.percentile(latencies, 95):.2f}s, max {max(latencies):.2f}s"
+            )
+        latencies.clear()
+        combineResults.clear()
+
+    def combineIfPaired(prefix):
+        frontKey, backKey = f"{prefix}-front", f"{prefix}-back"
+        if frontKey in inFlight["front"] or backKey in inFlight["back"]:
+            return  # the other side is on its way
+        frontCards = states["front"]["contourCoords"].get(frontKey)
+        backCards = states["back"]["contourCoords"].get(backKey)
+        if frontCards is None or backCards is None:
+            return  # wait for the other side to land
+        combined = combiner.combineScan(prefix, frontCards, backCards)
+        combineResults.append(combined)
+        if analyze:
+            analysisPool.submit(analyzeCombined, combined, analyze)
+        latency = time.time() - landed.pop(prefix, time.time())
+        latencies.append(latency)
+        print(f"[INFO] {prefix} done {latency:.2f}s after it landed")
+        if len(combineResults) >= reportEvery:
+            for state in states.values():
+                detector.saveState(state)
+            report()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool, ThreadPoolExecutor(max_workers=1) as analysisPool:
+        while not stopping or any(inFlight.values()):
+            try:
+                if not stopping:
+                    skipped = 0
+                    arrivals = hotFolder.poll(watch)
+                    arrivals.sort(key=lambda a: combiner.scanNumber(scanPrefix(os.path.basename(a[0]))))
+                    for inputPath, when in arrivals:
+                        baseName = os.path.splitext(os.path.basename(inputPath))[0]
+                        side = "front" if "front" in baseName.lower() else "back"
+                        if not detector.needsScan(states[side], inputPath, quiet=True):
+                            states[side]["pending"].pop(baseName, None)
+                            skipped += 1
+                            continue
+                        prefix = scanPrefix(baseName)
+                        landed[prefix] = max(landed.get(prefix, 0), when)
+                        inFlight[side].append(baseName)
+                        pool.submit(detectInto, side, inputPath)
+                    if skipped:
+                        print(f"[SKIP] {skipped} scans already processed")
+
+                # wait for detections until the next poll is due
+                deadline = time.time() + hotFolder.pollInterval
+                while True:
+                    try:
+                        side, result = resultQueue.get(timeout=max(0.0, deadline - time.time()))
+                    except queue.Empty:
+                        break
+                    ready[side][result["baseName"]] = result
+                    order = inFlight[side]
+                    while order and order[0] in ready[side]:
+                        baseName = order.popleft()
+                        detector.commitScan(states[side], ready[side].pop(baseName), writeCards)
+                        combineIfPaired(scanPrefix(baseName))
+            except KeyboardInterrupt:
+                if stopping:
+                    raise
+                stopping = True
+                print(f"\n[INFO] Stopping, finishing {sum(len(q) for q in inFlight.values())} scans in flight")
+
+    cardCache.flush()
+    for state in states.values():
+        detector.saveState(state)
+    report()
+    debugOutput.report()
@@ -1,34 +1,60 @@
-import subprocess
-import threading
-
-
-sV = 4
-frontScript = "python3 front-scanner-v" + str(sV) + ".py"
-backScript = "python3 back-scanner-v" + str(sV) + ".py"
-
-cV = 4
-combineScript = "python3 combine-v" + str(cV) + ".py"
-
-
-def run(script):
-    subprocess.run(script, shell=True)
-
-
-# Phase 1
-thread1 = threading.Thread(target=run, args=(frontScript,))
-thread2 = threading.Thread(target=run, args=(backScript,))
-
-print(f"Running Scripts: '{frontScript}' and '{backScript}'")
-thread1.start()
-thread2.start()
-
-# waiting game
-
-thread1.join()
-thread2.join()
-print(f"Scripts '{frontScript}' and '{backScript}' complete.")
-
-# Phase 2
-print(f"Running Script: '{combineScript}'")
-subprocess.run(combineScript, shell=True)
-print(f"Script `{combineScript}' complete.")
+import argparse
+
+import cardStore
+import debugOutput
+import detector
+import hotFolder
+import imageWriter
+import metrics
+import orientation
+from pipeline import runPipeline, runStreaming, runWatch
+
+# Runs detect -> combine (-> analysis) for every new scan in one process.
+# A scan starts combining as soon as both of its sides are detected. With
+# --watch it keeps running and picks up scans as they land in _INPUT.
+
+parser = argparse.ArgumentParser(description="Run the full scan pipeline in-process")
+parser.add_argument("--workers", type=int, default=None, help="threads to run stages on")
+parser.add_argument(
+    "--analyze",
+    nargs="?",
+    const="composite",
+    choices=["composite", "pairs"],
+    help="also run the card analysis model, on the composite pages (default) or on each matched front/back pair",
+)
+parser.add_argument("--stream", action="store_true", help="combine each scan as soon as both sides are cropped")
+parser.add_argument("--queue-depth", type=int, default=4, help="max scans in flight when streaming")
+parser.add_argument("--watch", action="store_true", help="keep running and process scans as they are dropped into _INPUT")
+parser.add_argument("--report-every", type=int, default=50, help="print stage times and latencies every N scans when watching")
+parser.add_argument(
+    "--no-card-files",
+    action="store_true",
+    help="hand cropped cards to the combiner in memory, only write output/front and output/back PNGs for cards that never got combined",
+)
+parser.add_argument("--db", default=cardStore.dbPath, help=f"card store database (default: {cardStore.dbPath})")
+imageWriter.addArguments(parser)
+debugOutput.addArguments(parser)
+detector.addArguments(parser)
+metrics.addArguments(parser)
+orientation.addArguments(parser)
+hotFolder.addArguments(parser)
+args = parser.parse_args()
+cardStore.dbPath = args.db
+imageWriter.configureFromArgs(args)
+debugOutput.configureFromArgs(args)
+detector.configureFromArgs(args)
+metrics.configureFromArgs(args)
+orientation.configureFromArgs(args)
+hotFolder.configureFromArgs(args)
+writeCards = not args.no_card_files
+if args.analyze == "pairs" and not writeCards:
+    parser.error("--analyze pairs reads the card PNGs, it cannot be combined with --no-card-files")
+if args.watch and args.stream:
+    parser.error("--watch already streams, pick one")
+
+if args.watch:
+    runWatch(workers=args.workers, analyze=args.analyze, writeCards=writeCards, reportEvery=max(1, args.report_every))
+elif args.stream:
+    runStreaming(workers=args.workers, queueDepth=max(1, args.queue_depth), analyze=args.analyze, writeCards=writeCards)
+else:
+    runPipeline(workers=args.workers, analyze=args.analyze, writeCards=writeCards)
@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+import os
+
+# ======= SYNTHETIC SCAN GENERATOR ======= #
+# Builds front/back scan pairs that look like the real ones closely enough to
+# time and check the detector and combiner: cards laid out two across on an
+# 8.5x11in sheet, each with its own rotation and jitter, on the gray scanner
+# lid or on black. The back of card i sits roughly where its front was, like
+# a flipped stack does on the scanner. Everything comes from one seeded rng,
+# so the same arguments always give the same scans.
+
+sheetInches = (8.5, 11)
+cardInches = (3.5, 5.5)  # a standard postcard, portrait rows of landscape cards
+backgrounds = ("gray", "black")
+
+
+def sheetSize(dpi):
+    return int(sheetInches[1] * dpi), int(sheetInches[0] * dpi)
+
+
+def background(rng, shape, kind):
+    if kind == "black":
+        return rng.integers(0, 12, shape, dtype=np.uint8)
+    # inside the detector's lowerGray/upperGray band
+    return rng.integers(32, 54, shape, dtype=np.uint8)
+
+
+def cardFace(rng, width, height, label):
+    # flat colour with print grain, a border and some "text" lines
+    color = rng.integers(90, 250, 3)
+    face = (rng.integers(0, 50, (height, width, 1)) + color).clip(0, 255).astype(np.uint8)
+    ink = tuple(int(c) for c in rng.integers(0, 60, 3))
+    cv2.rectangle(face, (0, 0), (width - 1, height - 1), ink, max(2, width // 200))
+    scale = width / 600
+    cv2.putText(face, label, (int(40 * scale), int(100 * scale)), cv2.FONT_HERSHEY_SIMPLEX, 2 * scale, ink, max(1, int(4 * scale)))
+    for row in range(3):
+        y = int(height * (0.55 + 0.12 * row))
+        cv2.line(face, (int(width * 0.1), y), (int(width * rng.uniform(0.5, 0.9)), y), ink, max(1, int(3 * scale)))
+    return face
+
+
+def layout(rng, dpi, cards, maxAngle, jitter):
+    # (centre, size, angle) per card: two columns, as many rows as needed
+    rows = -(-cards // 2)
+    h, w = sheetSize(dpi)
+    cardW, cardH = int(cardInches[1] * dpi * 0.85), int(cardInches[0] * dpi * 0.85)
+    rowPitch = h / rows
+    if cardH > rowPitch * 0.85:
+        # more rows than a sheet holds at postcard size, shrink the cards
+        shrink = rowPitch * 0.85 / cardH
+        cardW, cardH = int(cardW * shrink), int(cardH * shrink)
+    colPitch = w / 2
+    cardW = min(cardW, int(colPitch * 0.9))
+    slots = []
+    for i in range(cards):
+        r, c = divmod(i, 2)
+        cx = colPitch * (c + 0.5) + rng.uniform(-jitter, jitter) * dpi
+        cy = rowPitch * (r + 0.5) + rng.uniform(-jitter, jitter) * dpi
+        slots.append(((cx, cy), (cardW, cardH), rng.uniform(-maxAngle, maxAngle)))
+    return slots
+
+
+def paste(scan, face, centre, angle):
+    # rotate the card face into place, returns its corner points on the scan
+    height, width = face.shape[:2]
+    box = cv2.boxPoints((centre, (width, height), angle)).astype(np.float32)
+    corners = np.array([[0, height - 1], [0, 0], [width - 1, 0], [width - 1, height - 1]], np.float32)
+    # only warp into the card's bounding rect, not a whole scan sized frame
+    x, y, w, h = cv2.boundingRect(box)
+    x0, y0 = max(0, x), max(0, y)
+    x1, y1 = min(scan.shape[1], x + w), min(scan.shape[0], y + h)
+    M = cv2.getPerspectiveTransform(corners, box - np.float32([x0, y0]))
+    size = (x1 - x0, y1 - y0)
+    warped = cv2.warpPerspective(face, M, size, flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full((height, width), 255, np.uint8), M, size, flags=cv2.INTER_NEAREST)
+    cv2.copyTo(warped, mask, scan[y0:y1, x0:x1])
+    return box
+
+
+def generatePair(seed, dpi=300, cards=6, kind="gray", maxAngle=4.0, jitter=0.1):
+    # -> front scan, back scan, truth. truth["front"][i] and truth["back"][i]
+    # are the corner points of the same postcard on each scan.
+    rng = np.random.default_rng(seed)
+    shape = sheetSize(dpi) + (3,)
+    scans = {"front": background(rng, shape, kind), "back": background(rng, shape, kind)}
+    truth = {"front": [], "back": []}
+    for i, (centre, (w, h), angle) in enumerate(layout(rng, dpi, cards, maxAngle, jitter)):
+        for side in ("front", "back"):
+            if side == "back":
+                # not put back exactly where the front was
+                centre = (centre[0] + rng.uniform(-0.05, 0.05) * dpi, centre[1] + rng.uniform(-0.05, 0.05) * dpi)
+                angle = rng.uniform(-maxAngle, maxAngle)
+            face = cardFace(rng, w, h, f"{side.upper()} {i}")
+            truth[side].append(paste(scans[side], face, centre, angle))
+    return scans["front"], scans["back"], truth
+
+
+def cornerDistance(box, other):
+    # boxPoints can start on any corner, pair every corner with its nearest one
+    dists = np.linalg.norm(box[:, None, :] - other[None, :, :], axis=2)
+    return dists.min(axis=1).max()
+
+
+def writePair(directory, number, seed, **kwargs):
+    # sc{number}-front.png / -back.png, named like the real scans, for the scanner CLIs
+    front, back, truth = generatePair(seed, **kwargs)
+    cv2.imwrite(os.path.join(directory, f"sc{number:02d}-front.png"), front)
+    cv2.imwrite(os.path.join(directory, f"sc{number:02d}-back.png"), back)
+    return truth
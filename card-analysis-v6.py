@@ -1,128 +1,71 @@
+import argparse
 import os
-import ollama
-import re
-import json
-import time
 
-# ========================================INFO=======================================
-# 99% of the coding up until this point has been happening on my Mac laptop.        |
-# All of this code is built for my windows machine, because of its processing power.|
-# The following script locally loads the entire model, and runs it locally.         |
-# ========================================INFO=======================================
+import cardAnalysis
+import cardStore
+import metrics
+from cardAnalysis import analyzeImages, analyzePairs, listImages, listPairs
 
+# the scanner stages run from Phase-1, that is where their store and cards are
+phaseDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Phase-1")
 
-model = "gemma3:4b"
+parser = argparse.ArgumentParser(description="Analyse card images with the local model")
+parser.add_argument(
+    "--db",
+    default=os.path.join(phaseDir, cardStore.dbPath),
+    help="card store database (default: the one in Phase-1, next to the scanner stages)",
+)
+parser.add_argument(
+    "--concurrency", type=int, default=cardAnalysis.concurrency, help="requests in flight at once"
+)
+parser.add_argument("--host", default=None, help="ollama server (default: OLLAMA_HOST or localhost:11434)")
+parser.add_argument("--folder", default=None, help="image folder (default: read from SENSITIVE/IMAGE_FOLDER)")
+parser.add_argument(
+    "--pairs",
+    action="store_true",
+    help="analyse each matched front/back pair from cards.db in one request instead of the composite pages",
+)
+parser.add_argument("--model", default=cardAnalysis.model, help=f"ollama model (default: {cardAnalysis.model})")
+parser.add_argument("--prompt-file", default=None, help="read the prompt from this file instead, e.g. to A/B two prompts")
+parser.add_argument(
+    "--cards-dir",
+    default=os.path.join(phaseDir, "output"),
+    help="folder holding front/ and back/ card PNGs, with --pairs (default: Phase-1/output)",
+)
+parser.add_argument(
+    "--input-size",
+    type=int,
+    default=cardAnalysis.inputSize,
+    help="shrink cards to this longest side before sending, 0 sends the original PNG",
+)
+parser.add_argument("--image-format", choices=["jpg", "webp"], default=cardAnalysis.imageFormat)
+parser.add_argument("--image-quality", type=int, default=cardAnalysis.imageQuality)
+metrics.addArguments(parser)
+args = parser.parse_args()
+metrics.configureFromArgs(args)
+cardStore.dbPath = args.db
+cardAnalysis.host = args.host
+cardAnalysis.model = args.model
+if args.prompt_file:
+    with open(args.prompt_file, "r") as f:
+        if args.pairs:
+            cardAnalysis.pairPrompt = f.read()
+        else:
+            cardAnalysis.prompt = f.read()
+cardAnalysis.inputSize = args.input_size
+cardAnalysis.imageFormat = args.image_format
+cardAnalysis.imageQuality = args.image_quality
 
-# Set up the images
-imageFolder = open("SENSITIVE/IMAGE_FOLDER", "r").read()
-images = [img for img in os.listdir(imageFolder) if img.lower().endswith(".png")]
-
-# Parse out and clean up JSON
-def cleanJSON(content, isRaw=True):
-    if isRaw: # this was tedious
-        cleaned = re.sub(r"^```json\s*|```$", "", content.strip(), flags=re.IGNORECASE | re.MULTILINE).strip()
-        parsed = json.loads(cleaned)
-        return cleanJSON(parsed, isRaw=False)
-    if isinstance(content, dict):
-        return {k: cleanJSON(v, isRaw=False) for k, v in content.items()}
-    if isinstance(content, list):
-        return [cleanJSON(elem, isRaw=False) for elem in content]
-    if isinstance(content, str) and content.strip().lower() in ("unknown", "not avalible"):
-        return ""
-    return content
-
-
-# I'm very proud of these, they work really well.
-prompt = """This is a vintage postcard. Carefully analyze the image in much detail, and prepare to export the found data into a JSON structure. 
-Use all of the present text on the image to your advantage. Please do not generate any text content that cannot be found in the photo, for example, sender or reciever details, and printed or handwritten text.
-Only respond with a JSON structure, and no plain text. If there is no title present, create a fitting title, with no more than 5 words. 
-If data for a field cannot be found, do not insert Unknown, instead please leave it empty. Do not include escape characters in your response. Assume the longitude and latitude to the best of your ability.
-Please format your response in the following JSON structure."""
-jsonStructure = """{
-        "title": "",
-        "description": "",
-        "estimated_date": "",
-        "location_depicted": {
-            "street_address": "",
-            "city": "",
-            "state": "",
-            "country": "",
-            "longitude": "",
-            "latitude": "",
-        },
-        "front": {
-            "caption": "",
-            "image_type": "Photograph/Cartoon/Illustration",
-            "color": "Full Color/B&W/Sepia",
-            "publisher": "",
-            "series_number": ""
-        },
-        "back": {
-            "printed_text": "",
-            "handwritten_text": "",
-            "legibility": "Excelent/Moderate/Poor/Illegible",
-            "language": "",
-            "text_style": ""
-        },
-        "sender": {
-            "name": "",
-            "city": "",
-            "state": "",
-            "country": "",
-            "address": "",
-            "date_sent": ""
-        },
-        "recipient": {
-            "name": "",
-            "address": "",
-            "date_received": ""
-        },
-        "condition": {
-            "rating": "Mint/Good/Fair/Poor",
-            "damage": [
-                ""
-            ],
-            "damage_notes": ""
-        },
-        "general_notes": ""
-    }"""
-
-# load JSON file
-if os.path.exists("analysis.json"):
-    with open("analysis.json", "r") as f:
-        allData = json.load(f)
+if args.pairs:
+    pairs = listPairs(args.cards_dir)
+    if not pairs:
+        print(f"[WARN] No matched pairs in {args.db}, run combine-v4.py first")
+    analyzePairs(pairs, workers=max(1, args.concurrency))
 else:
-    allData = {}
-
-# Process each image
-for imageName in images:
-    startTime = time.time()
-    imagePath = os.path.join(imageFolder, imageName)
-
-    jsonKeyName = imageName # This already has a .png extension as the name
-
-    if jsonKeyName in allData:
-        print(f"Skipping {jsonKeyName} (already processed).")
-        continue
-
-    print(f"Processing {imageName}...")
+    # Set up the images
+    imageFolder = args.folder or open("SENSITIVE/IMAGE_FOLDER", "r").read()
+    images = [os.path.join(imageFolder, img) for img in listImages(imageFolder)]
 
-    with open(imagePath, "rb") as imageFile:
-        response = ollama.chat(
-            model=model,
-            messages=[
-                {
-                    "role": "user",
-                    "content": prompt + jsonStructure,
-                    "images": [imageFile.read()],
-                }
-            ],
-        )
-    content = response["message"]["content"]
+    analyzeImages(images, workers=max(1, args.concurrency))
 
-    clean = cleanJSON(content)
-    allData[jsonKeyName] = clean
-    with open("analysis.json", "w") as f:
-        json.dump(dict(sorted(allData.items())), f, indent=4)
-    print(f"Saved {jsonKeyName} > [{time.time()-startTime:.3}s @ {time.strftime('%H:%M:%S')}]")
-    # Saved card0135.png > [10.0s @ 13:22:54]
\ No newline at end of file
+metrics.report()
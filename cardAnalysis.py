@@ -0,0 +1,329 @@
+import cv2
+import hashlib
+import numpy as np
+import os
+import ollama
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# the card store lives with the scanner stages
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "Phase-1"))
+import cardStore
+import metrics
+import responseParser
+
+# ========================================INFO=======================================
+# 99% of the coding up until this point has been happening on my Mac laptop.        |
+# All of this code is built for my windows machine, because of its processing power.|
+# The following script locally loads the entire model, and runs it locally.         |
+# ========================================INFO=======================================
+
+
+model = "gemma3:4b"
+host = None  # ollama server, None uses OLLAMA_HOST or localhost:11434
+keepAlive = None  # how long ollama keeps the model loaded after a reply, None is its default (5m), -1 forever
+
+# Requests run on a thread pool, `concurrency` of them in flight at once. The
+# ollama server only answers them in parallel with OLLAMA_NUM_PARALLEL > 1.
+concurrency = 4
+streamReplies = True  # parse replies as they are generated, drop hopeless ones early
+maxAttempts = 3  # per card, a malformed reply is asked again
+retryDelay = 1.0  # seconds, doubled after every failed attempt
+
+# Cards are shrunk to the model's input size and re-encoded before sending, the
+# model would downsample them anyway. Encoded images are cached on disk by
+# content hash and target size, so re-runs don't decode or encode anything.
+inputSize = 896  # px, longest side (gemma3 sees 896x896), 0 sends the original file
+imageFormat = "jpg"  # jpg / webp
+imageQuality = 85
+imageCacheDir = "cache/analysisImages"
+
+clientLock = threading.Lock()
+client = None
+
+
+def listImages(imageFolder):
+    return [img for img in os.listdir(imageFolder) if img.lower().endswith(".png")]
+
+
+# I'm very proud of these, they work really well.
+prompt = """This is a vintage postcard. Carefully analyze the image in much detail, and prepare to export the found data into a JSON structure.
+Use all of the present text on the image to your advantage. Please do not generate any text content that cannot be found in the photo, for example, sender or reciever details, and printed or handwritten text.
+Only respond with a JSON structure, and no plain text. If there is no title present, create a fitting title, with no more than 5 words.
+If data for a field cannot be found, do not insert Unknown, instead please leave it empty. Do not include escape characters in your response. Assume the longitude and latitude to the best of your ability.
+Please format your response in the following JSON structure."""
+# matched front/back pairs go out as one request with both crops
+pairPrompt = prompt.replace(
+    "This is a vintage postcard. Carefully analyze the image",
+    "These are the two sides of one vintage postcard: the first image is the front, the second image is the back. Carefully analyze both images",
+)
+jsonStructure = """{
+        "title": "",
+        "description": "",
+        "estimated_date": "",
+        "location_depicted": {
+            "street_address": "",
+            "city": "",
+            "state": "",
+            "country": "",
+            "longitude": "",
+            "latitude": "",
+        },
+        "front": {
+            "caption": "",
+            "image_type": "Photograph/Cartoon/Illustration",
+            "color": "Full Color/B&W/Sepia",
+            "publisher": "",
+            "series_number": ""
+        },
+        "back": {
+            "printed_text": "",
+            "handwritten_text": "",
+            "legibility": "Excelent/Moderate/Poor/Illegible",
+            "language": "",
+            "text_style": ""
+        },
+        "sender": {
+            "name": "",
+            "city": "",
+            "state": "",
+            "country": "",
+            "address": "",
+            "date_sent": ""
+        },
+        "recipient": {
+            "name": "",
+            "address": "",
+            "date_received": ""
+        },
+        "condition": {
+            "rating": "Mint/Good/Fair/Poor",
+            "damage": [
+                ""
+            ],
+            "damage_notes": ""
+        },
+        "general_notes": ""
+    }"""
+
+
+# what every reply is checked against and shaped into
+schema = responseParser.schemaFrom(jsonStructure)
+
+
+def getClient():
+    global client
+    with clientLock:
+        if client is None:
+            client = ollama.Client(host=host)
+        return client
+
+
+def warmUp():
+    # load the model now rather than on the first card, a chat without
+    # messages makes ollama load it and return straight away
+    try:
+        getClient().chat(model=model, messages=[], keep_alive=keepAlive)
+        return True
+    except Exception as e:
+        print(f"[WARN] Could not load {model}: {e}")
+        return False
+
+
+def encodeParams():
+    if imageFormat == "webp":
+        return [cv2.IMWRITE_WEBP_QUALITY, imageQuality]
+    return [cv2.IMWRITE_JPEG_QUALITY, imageQuality]
+
+
+def fileDigest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def prepareImage(imagePath, digest=None):
+    # bytes to send for `imagePath`: shrunk and re-encoded, from the cache if possible
+    if not inputSize:
+        with open(imagePath, "rb") as imageFile:
+            return imageFile.read()
+
+    digest = digest or fileDigest(imagePath)
+    cachePath = os.path.join(imageCacheDir, f"{digest}-{inputSize}-q{imageQuality}.{imageFormat}")
+    if os.path.exists(cachePath):
+        with open(cachePath, "rb") as f:
+            return f.read()
+
+    with open(imagePath, "rb") as imageFile:
+        original = imageFile.read()
+
+    image = cv2.imdecode(np.frombuffer(original, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return original
+    scale = inputSize / max(image.shape[:2])
+    if scale < 1:
+        image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(f".{imageFormat}", image, encodeParams())
+    if not ok:
+        return original
+
+    os.makedirs(imageCacheDir, exist_ok=True)
+    tmpPath = f"{cachePath}.{threading.get_ident()}.tmp"
+    with open(tmpPath, "wb") as f:
+        f.write(encoded.tobytes())
+    os.replace(tmpPath, cachePath)
+    return encoded.tobytes()
+
+
+def analyzeImage(imagePath):
+    return requestAnalysis(os.path.basename(imagePath), [imagePath], prompt)[0]
+
+
+def readReply(messages):
+    # The reply text, or a ResponseError as soon as it is clearly malformed. With
+    # streamReplies the stream is dropped once the object is closed or hopeless.
+    if not streamReplies:
+        response = getClient().chat(model=model, messages=messages, keep_alive=keepAlive)
+        return responseParser.parse(response["message"]["content"], schema)
+
+    parser = responseParser.StreamParser(schema)
+    stream = getClient().chat(model=model, messages=messages, stream=True, keep_alive=keepAlive)
+    try:
+        for chunk in stream:
+            parser.feed(chunk["message"]["content"])
+            if parser.complete or parser.failed:
+                break
+    finally:
+        stream.close()
+    return parser.result()
+
+
+def requestAnalysis(key, imagePaths, text, digests=None):
+    # -> (record, problems), problems being what had to be repaired in the reply
+    with metrics.span("prepare", key):
+        images = [prepareImage(path, digest) for path, digest in zip(imagePaths, digests or [None] * len(imagePaths))]
+    metrics.count("bytesSent", sum(len(image) for image in images))
+    messages = [
+        {
+            "role": "user",
+            "content": text + jsonStructure,
+            "images": images,
+        }
+    ]
+
+    delay = retryDelay
+    for attempt in range(1, maxAttempts + 1):
+        try:
+            with metrics.span("model", key):
+                record, problems = readReply(messages)
+        except responseParser.ResponseError as e:
+            if attempt == maxAttempts:
+                raise
+            print(f"[WARN] Malformed reply for {key} ({e}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+            delay *= 2
+            continue
+        if problems:
+            print(f"[WARN] {key}: repaired {len(problems)} fields ({', '.join(problems[:3])}{', ...' if len(problems) > 3 else ''})")
+        return record, problems
+
+
+def timedAnalysis(job, digests):
+    startTime = time.time()
+    return requestAnalysis(*job, digests=digests), time.time() - startTime
+
+
+def promptHash(text):
+    return hashlib.sha1((text + jsonStructure).encode()).hexdigest()[:16]
+
+
+def cacheKey(digests, text):
+    # (images, model, prompt): a result is reused only if all three are the same
+    inputHash = hashlib.sha1(":".join(digests).encode()).hexdigest()
+    return (inputHash, model, promptHash(text))
+
+
+# records saved before the cache existed were made with the default model
+# and composite prompt, taken here before any caller overrides them
+legacyKey = (model, promptHash(prompt))
+
+
+def runAnalyses(jobs, workers=None):
+    # jobs = [(key, [imagePath, ...], prompt), ...]. Results come from the
+    # analysis cache when the same images were already analysed with the same
+    # model and prompt. The rest are requested `workers` (default: concurrency)
+    # at a time and saved in input order, as soon as they and every job before
+    # them are done.
+    todo = []
+    hits = 0
+    for job in jobs:
+        jsonKeyName, imagePaths, text = job
+        digests = [fileDigest(path) for path in imagePaths]
+        key = cacheKey(digests, text)
+        cached = cardStore.cachedAnalysis(key)
+        if cached is None and key[1:] == legacyKey and not cardStore.hasCachedImage(jsonKeyName):
+            # analysed before there was a cache, with these same defaults: adopt the record
+            cached = cardStore.getAnalysis(jsonKeyName)
+        if cached is not None:
+            cardStore.saveAnalysis(jsonKeyName, cached, key)
+            print(f"Skipping {jsonKeyName} (cached).")
+            hits += 1
+            continue
+        todo.append((job, digests, key))
+
+    if jobs:
+        print(f"[CACHE] {hits}/{len(jobs)} from the analysis cache ({100 * hits / len(jobs):.0f}% hit rate)")
+    if not todo:
+        return
+
+    runStart = time.time()
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers or concurrency, thread_name_prefix="analysis") as pool:
+        futures = [pool.submit(timedAnalysis, job, digests) for job, digests, _ in todo]
+        for (job, _, key), future in zip(todo, futures):
+            jsonKeyName = job[0]
+            try:
+                (clean, problems), took = future.result()
+            except Exception as e:
+                print(f"[ERROR] {jsonKeyName} failed: {e}")
+                failed.append(jsonKeyName)
+                continue
+            # a record with fields filled in as empty is kept, but not reused
+            # from the cache: the next run asks the model again
+            complete = not any(problem.endswith(": missing") for problem in problems)
+            cardStore.saveAnalysis(jsonKeyName, clean, key, complete)
+            print(f"Saved {jsonKeyName} > [{took:.3}s @ {time.strftime('%H:%M:%S')}]")
+            # Saved card0135.png > [10.0s @ 13:22:54]
+
+    elapsed = time.time() - runStart
+    done = len(todo) - len(failed)
+    print(f"[TIME] Analysed {done} cards in {elapsed:.1f}s ({done / elapsed:.2f} cards/s), {len(failed)} failed")
+
+
+def analyzeImages(imagePaths, workers=None):
+    # one request per image, keyed by file name (composites: cardNNNN.png)
+    # the file name already has the .png extension
+    runAnalyses([(os.path.basename(path), [path], prompt) for path in imagePaths], workers)
+
+
+def analyzePairs(pairs, workers=None):
+    # pairs = [(frontCardID, frontPath, backPath), ...], one request per
+    # postcard with both crops, keyed by the front card (cardNNNN)
+    runAnalyses([(cardID, [frontPath, backPath], pairPrompt) for cardID, frontPath, backPath in pairs], workers)
+
+
+def listPairs(cardsDir="output"):
+    # matched pairs from the combiner, whose card PNGs are on disk
+    pairs = []
+    for front, back in cardStore.loadMatches():
+        frontPath = os.path.join(cardsDir, "front", f"{front}_front.png")
+        backPath = os.path.join(cardsDir, "back", f"{back}_back.png")
+        if os.path.exists(frontPath) and os.path.exists(backPath):
+            pairs.append((front, frontPath, backPath))
+        else:
+            print(f"[WARN] Missing card image for {front} / {back}, skipping")
+    return pairs
@@ -0,0 +1,118 @@
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# ======= OLLAMA STUB SERVER ======= #
+# Answers POST /api/chat like an ollama server would, after a fixed delay, so
+# the analysis runner can be timed without a model. At most --parallel requests
+# are "generated" at once (like OLLAMA_NUM_PARALLEL), the rest queue up. A
+# share of the replies can be cut off or answered in prose to exercise the
+# retry path. Streamed requests get the reply as NDJSON chunks spread over the
+# delay, and the stub notices when the client hangs up early.
+#
+#   python3 ollama-stub.py --delay 2 --parallel 4
+#   python3 card-analysis-v6.py --host http://127.0.0.1:11435 --folder output/final --concurrency 4
+
+reply = {
+    "title": "Stub Postcard",
+    "description": "A reply from ollama-stub.py",
+    "estimated_date": "1910",
+    "location_depicted": {"street_address": "", "city": "Unknown", "state": "", "country": "", "longitude": "", "latitude": ""},
+    "front": {"caption": "", "image_type": "Photograph", "color": "Sepia", "publisher": "", "series_number": ""},
+    "back": {"printed_text": "", "handwritten_text": "", "legibility": "Poor", "language": "English", "text_style": ""},
+    "sender": {"name": "", "city": "", "state": "", "country": "", "address": "", "date_sent": ""},
+    "recipient": {"name": "", "address": "", "date_received": ""},
+    "condition": {"rating": "Good", "damage": [""], "damage_notes": ""},
+    "general_notes": "",
+}
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if self.path != "/api/chat":
+            self.send_error(404)
+            return
+
+        content = "```json\n" + json.dumps(reply, indent=4) + "\n```"
+        roll = random.random()
+        if roll < self.server.malformedRate:
+            content = content[: len(content) // 2]  # cut off mid-generation
+        elif roll < self.server.malformedRate + self.server.proseRate:
+            content = "Sure! This postcard shows " + "a lovely scene, " * 200
+
+        with self.server.slots:
+            if body.get("stream", True):
+                self.streamReply(body, content)
+            else:
+                time.sleep(self.server.delay)
+                self.sendReply(body, content)
+        with self.server.lock:
+            self.server.served += 1
+
+    def message(self, body, content, done):
+        message = {
+            "model": body.get("model", ""),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "message": {"role": "assistant", "content": content},
+            "done": done,
+        }
+        if done:
+            message["done_reason"] = "stop"
+        return json.dumps(message).encode()
+
+    def sendReply(self, body, content):
+        payload = self.message(body, content, True)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def streamReply(self, body, content):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = [content[i : i + 16] for i in range(0, len(content), 16)] + [""]
+        try:
+            for i, piece in enumerate(pieces):
+                time.sleep(self.server.delay / len(pieces))
+                line = self.message(body, piece, i == len(pieces) - 1) + b"\n"
+                self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+                self.wfile.flush()
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            with self.server.lock:
+                self.server.dropped += 1
+
+    def log_message(self, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in for the ollama chat API")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--delay", type=float, default=2.0, help="seconds per reply")
+    parser.add_argument("--parallel", type=int, default=4, help="replies generated at once")
+    parser.add_argument("--malformed", type=float, default=0.0, help="share of replies cut off (0-1)")
+    parser.add_argument("--prose", type=float, default=0.0, help="share of replies in prose instead of JSON (0-1)")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), StubHandler)
+    server.delay = args.delay
+    server.slots = threading.BoundedSemaphore(max(1, args.parallel))
+    server.malformedRate = args.malformed
+    server.proseRate = args.prose
+    server.lock = threading.Lock()
+    server.served = 0
+    server.dropped = 0
+    print(f"[INFO] ollama stub on http://127.0.0.1:{args.port} ({args.delay}s per reply, {args.parallel} at once)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n[INFO] Served {server.served} replies, {server.dropped} streams dropped early by the client")
@@ -0,0 +1,198 @@
+import json
+import re
+
+# ======= MODEL RESPONSE PARSER ======= #
+# Turns a model reply into a record shaped like the prompt's JSON template.
+# repair() fixes the usual model mistakes (code fences, prose around the object,
+# trailing commas, output cut off mid-generation), conform() then walks the
+# parsed reply once against the template: missing fields are filled in, unknown
+# placeholders blanked and stray types coerced. parse() still rejects a reply
+# that was cut off or misses too many fields, so the caller asks again.
+# StreamParser does the same on a streamed reply and can tell early that a
+# reply is going nowhere.
+
+blankValues = ("unknown", "not avalible", "not available")
+maxReplyChars = 20000  # a reply this long is looping, not answering
+maxPreambleChars = 500  # prose allowed before the object ("Here is the JSON: {...")
+maxMissingShare = 0.25  # of the template's fields, a reply missing more is rejected
+
+
+class ResponseError(ValueError):
+    pass
+
+
+# === REPAIR ===
+def scan(text):
+    # Structural state at the end of `text`: the open brackets, whether it ends
+    # inside a string, and where the top level object closed (-1: still open).
+    stack = []
+    inString = escaped = False
+    for i, ch in enumerate(text):
+        if inString:
+            if escaped:
+                escaped = False
+            elif ch == "\\":
+                escaped = True
+            elif ch == '"':
+                inString = False
+        elif ch == '"':
+            inString = True
+        elif ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            if not stack:
+                return stack, False, i
+    return stack, inString, -1
+
+
+def repair(text):
+    start = text.find("{")
+    if start == -1:
+        raise ResponseError("no JSON object in reply")
+    text = text[start:]
+
+    stack, inString, end = scan(text)
+    if end != -1:
+        text = text[: end + 1]  # drop the closing fence and anything after it
+    else:
+        # cut off: close the open string, drop a dangling key or comma, close the rest
+        if inString:
+            text += '"'
+        text = re.sub(r'(,\s*"[^"]*"\s*:?\s*|,\s*|:\s*)$', "", text.rstrip())
+        if re.search(r'[{,]\s*"[^"]*"$', text):
+            text += ': ""'
+        text += "".join("}" if b == "{" else "]" for b in reversed(stack))
+
+    # trailing commas, like the one in the prompt's own template
+    return re.sub(r",(\s*[}\]])", r"\1", text)
+
+
+# === VALIDATE ===
+def schemaFrom(template):
+    return json.loads(repair(template))
+
+
+def conform(value, schema, path="", problems=None):
+    # One pass over `value`, shaped like `schema`. Problems are collected, not raised.
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            if value not in (None, ""):
+                problems.append(f"{path or 'reply'}: expected an object")
+            value = {}
+        out = {}
+        for key, sub in schema.items():
+            if key not in value:
+                problems.append(f"{path}{key}: missing")
+            out[key] = conform(value.get(key), sub, f"{path}{key}.", problems)
+        return out
+    if isinstance(schema, list):
+        if value in (None, ""):
+            return []
+        if not isinstance(value, list):
+            value = [value]
+        item = schema[0] if schema else ""
+        return [conform(v, item, path, problems) for v in value]
+    # leaf: the template only has strings
+    if value is None:
+        return ""
+    if isinstance(value, (dict, list)):
+        problems.append(f"{path.rstrip('.')}: expected text")
+        return json.dumps(value)
+    if not isinstance(value, str):
+        return str(value)
+    if value.strip().lower() in blankValues:
+        return ""
+    return value
+
+
+def countFields(schema):
+    if isinstance(schema, dict):
+        return sum(1 + countFields(sub) for sub in schema.values())
+    return 0
+
+
+def parse(text, schema):
+    # -> (record, problems). Raises ResponseError if the reply was cut off, misses
+    # more than maxMissingShare of the fields or has nothing usable in it.
+    start = text.find("{")
+    if start != -1 and scan(text[start:])[2] == -1:
+        raise ResponseError("reply cut off before the object closed")
+    try:
+        parsed = json.loads(repair(text))
+    except json.JSONDecodeError as e:
+        raise ResponseError(f"unparseable reply ({e})") from e
+    if not isinstance(parsed, dict):
+        raise ResponseError("reply is not a JSON object")
+    problems = []
+    record = conform(parsed, schema, "", problems)
+    missing = sum(problem.endswith(": missing") for problem in problems)
+    if missing > maxMissingShare * countFields(schema):
+        raise ResponseError(f"reply is missing {missing} of {countFields(schema)} fields")
+    if all(v in ("", [], {}) for v in flattenValues(record)):
+        raise ResponseError("reply has no usable fields")
+    return record, problems
+
+
+def flattenValues(record):
+    for value in record.values():
+        if isinstance(value, dict):
+            yield from flattenValues(value)
+        else:
+            yield value
+
+
+# === STREAMING ===
+class StreamParser:
+    # Feed it the reply as it is generated. `failed` is set as soon as the reply
+    # can't turn into a record (prose with no object in sight, runaway length),
+    # so the caller can drop the stream and retry. A short preamble before the
+    # object is fine, parse() drops it. `complete` is set once the top level
+    # object has closed, anything after that is not needed. A stream that ends
+    # before that was cut off and is rejected too.
+
+    def __init__(self, schema):
+        self.schema = schema
+        self.text = ""
+        self.stack = []
+        self.inString = self.escaped = False
+        self.started = self.complete = False
+        self.failed = None
+
+    def feed(self, chunk):
+        for ch in chunk:
+            self.text += ch
+            if not self.started:
+                if ch == "{":
+                    self.started = True
+                    self.stack.append(ch)
+                elif len(self.text) > maxPreambleChars:
+                    self.failed = f"no JSON object in the first {maxPreambleChars} characters"
+                    return
+                continue
+            if self.inString:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.inString = False
+            elif ch == '"':
+                self.inString = True
+            elif ch in "{[":
+                self.stack.append(ch)
+            elif ch in "}]":
+                self.stack.pop()
+                if not self.stack:
+                    self.complete = True
+                    return
+        if len(self.text) > maxReplyChars:
+            self.failed = f"reply longer than {maxReplyChars} characters"
+
+    def result(self):
+        if self.failed:
+            raise ResponseError(self.failed)
+        if not self.complete:
+            raise ResponseError("reply ended before the object closed")
+        return parse(self.text, self.schema)